@@ -1,5 +1,6 @@
 from django.contrib import admin
 from judge import models
+from judge.scoreboard import bump_version
 
 class ContestAdmin(admin.ModelAdmin):
     prepopulated_fields = {"slug": ("name",)}
@@ -7,12 +8,22 @@ class ContestAdmin(admin.ModelAdmin):
         (None, {
             'fields': ('name', 'slug', 'begin_at', 'end_at', 'description'),
         },),
+        ('Scoreboard Freeze', {
+            'classes': ('collapse',),
+            'fields': ('freeze_at', 'unfreeze_at'),
+        },),
         ('Advanced Options', {
             'classes': ('collapse',),
             'fields': ('contestants',),
         },),
     )
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Penalties count from begin_at and the frozen board from freeze_at.
+        for name in ("version", "frozen", "ranking"):
+            bump_version(obj.id, name)
+
 class ProblemPartAdmin(admin.TabularInline):
     model = models.ProblemPart
 
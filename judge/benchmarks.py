@@ -0,0 +1,456 @@
+from collections import OrderedDict, Counter
+from contextlib import contextmanager
+from datetime import timedelta
+import io
+import os
+import random
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.client import Client
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test.utils import setup_test_environment, teardown_test_environment, CaptureQueriesContext
+from django.utils import timezone
+from judge import settings
+from judge.models import Attempt, BestScore, Contest, Problem, ProblemPart
+from judge.scoreboard import bump_version
+from judge.checkers import TokenChecker, CHUNK_SIZE
+from judge.util import percentiles
+
+SUITES = OrderedDict()
+
+def suite(name):
+    def register(func):
+        SUITES[name] = func
+        return func
+    return register
+
+@contextmanager
+def test_database():
+    """
+    Runs a suite against a fresh throwaway database. SQLite gets a file
+    rather than :memory: so that every thread sees the same data.
+    """
+    workdir = tempfile.mkdtemp(prefix="judge-bench-")
+    if connection.vendor == 'sqlite':
+        connection.settings_dict['TEST_NAME'] = os.path.join(workdir, "bench.sqlite3")
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        shutil.rmtree(workdir)
+
+def create_contest(slug, problems=1, parts=1, points=10, time_limit=600):
+    now = timezone.now()
+    contest = Contest.objects.create(name=slug, slug=slug, description="",
+            begin_at=now - timedelta(hours=1), end_at=now + timedelta(hours=4))
+    for p in range(problems):
+        problem = Problem.objects.create(contest=contest, name="Problem %d" % p,
+                order=chr(ord('A') + p % 26) + ("" if p < 26 else str(p // 26)),
+                slug="problem-%d" % p, time_limit=time_limit)
+        for k in range(parts):
+            ProblemPart.objects.create(problem=problem, name="part%d" % k, points=points, order=k)
+    return contest
+
+def create_users(contest, count, password="bench"):
+    # Hash once; hashing a password per team would dominate the setup time.
+    hashed = make_password(password)
+    User.objects.bulk_create([User(username="team%d" % i, password=hashed) for i in range(count)])
+    users = list(User.objects.filter(username__startswith="team").order_by('id'))
+    contest.contestants.add(*users)
+    return users
+
+def seed_best_scores(contest, users, seed=1):
+    rng = random.Random(seed)
+    parts = list(ProblemPart.objects.filter(problem__contest=contest))
+    BestScore.objects.bulk_create([
+        BestScore(user=user, part=part, score=rng.choice((0, part.points)), attempts=rng.randint(1, 5))
+        for user in users for part in parts if rng.random() < 0.7
+    ])
+
+def seed_attempts(contest, users, per_team, seed=1):
+    """
+    Gives every team a history of judged attempts spread over the parts,
+    then rebuilds BestScore from it the way a live contest would have.
+    """
+    rng = random.Random(seed)
+    parts = list(ProblemPart.objects.filter(problem__contest=contest))
+    attempts = []
+    for user in users:
+        for i in range(per_team):
+            part = rng.choice(parts)
+            correct = rng.random() < 0.4
+            attempts.append(Attempt(owner=user, part=part, testfileid=rng.randrange(settings.TESTFILES_PER_PART),
+                    status=Attempt.CORRECT if correct else Attempt.INCORRECT,
+                    reason=Attempt.ACCEPTED if correct else Attempt.WRONG_ANSWER,
+                    score=part.points if correct else 0, randomness="0" * 16, outputfile="attempt.out"))
+    Attempt.objects.bulk_create(attempts, batch_size=500)
+    call_command('rebuild_scores', stdout=io.StringIO())
+
+@contextmanager
+def secret_dir():
+    """
+    Points SECRET_DIR at a scratch directory for the duration of a suite.
+    """
+    original = settings.SECRET_DIR
+    settings.SECRET_DIR = tempfile.mkdtemp(prefix="judge-bench-secret-")
+    try:
+        yield settings.SECRET_DIR
+    finally:
+        shutil.rmtree(settings.SECRET_DIR)
+        settings.SECRET_DIR = original
+
+def measure(request, count, before=None):
+    """
+    Calls `request` `count` times and reports its latency percentiles, the
+    number of queries per call and the response status codes.
+    """
+    latencies = []
+    queries = []
+    statuses = Counter()
+    for i in range(count):
+        if before:
+            before()
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = request()
+            latencies.append(time.perf_counter() - start)
+        queries.append(len(captured))
+        statuses[response.status_code] += 1
+    total = sum(latencies)
+    return OrderedDict([
+        ('requests_per_sec', count / total if total else None),
+        ('latency', percentiles(latencies)),
+        ('queries', percentiles(queries)),
+        ('statuses', dict(statuses)),
+    ])
+
+def logged_in_client(user, password="bench"):
+    client = Client()
+    client.login(username=user.username, password=password)
+    return client
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def write_output(path, megabytes, seed, mismatch_at=None):
+    rng = random.Random(seed)
+    target = megabytes * 1024 * 1024
+    written = 0
+    line = 0
+    with open(path, "w") as f:
+        while written < target:
+            tokens = [str(rng.randint(0, 10 ** 9)) for i in range(8)]
+            if line == mismatch_at:
+                tokens[0] = "x"
+            text = " ".join(tokens) + "\n"
+            f.write(text)
+            written += len(text)
+            line += 1
+
+def readlines_reason(answer, oracle):
+    """
+    The comparison judge.util.score used to make, kept as a baseline.
+    """
+    answerlines = answer.readlines()
+    oraclelines = oracle.readlines()
+    if len(answerlines) != len(oraclelines):
+        return Attempt.BAD_SUBMISSION
+    if all(mine.split() == theirs.split() for mine, theirs in zip(oraclelines, answerlines)):
+        return Attempt.ACCEPTED
+    return Attempt.WRONG_ANSWER
+
+@suite("checker")
+def checker(options):
+    """
+    Compares multi-hundred-megabyte outputs with the streaming checker and,
+    with --baseline, with the old readlines() comparison.
+    """
+    size = options.get('size') or 200
+    workdir = tempfile.mkdtemp(prefix="judge-bench-")
+    results = OrderedDict()
+    try:
+        oracle = os.path.join(workdir, "oracle.out")
+        same = os.path.join(workdir, "same.out")
+        early = os.path.join(workdir, "early.out")
+        write_output(oracle, size, 1)
+        write_output(same, size, 1)
+        write_output(early, size, 1, mismatch_at=10)
+
+        comparators = [('streaming', TokenChecker().check)]
+        if options.get('baseline'):
+            comparators.append(('readlines', readlines_reason))
+
+        for name, compare in comparators:
+            for case, answer in (('accepted', same), ('early_mismatch', early)):
+                start = time.perf_counter()
+                with open(answer, "r", buffering=CHUNK_SIZE) as a, open(oracle, "r", buffering=CHUNK_SIZE) as o:
+                    reason = compare(a, o)
+                elapsed = time.perf_counter() - start
+                results["%s.%s" % (name, case)] = OrderedDict([
+                    ('reason', reason),
+                    ('seconds', elapsed),
+                    ('mb_per_sec', size / elapsed if elapsed else None),
+                    ('peak_rss_mb', peak_rss_mb()),
+                ])
+    finally:
+        shutil.rmtree(workdir)
+    return results
+
+@suite("testfiles")
+def testfiles(options):
+    """
+    Hammers start_submit from concurrent clients on one part and checks that
+    test file numbers are unique and evenly spread.
+    """
+    threads = options.get('threads') or 8
+    requests = options.get('requests') or 200
+    results = OrderedDict()
+
+    with test_database():
+        contest = create_contest("bench-testfiles")
+        part = ProblemPart.objects.get(problem__contest=contest)
+        users = create_users(contest, threads)
+        url = reverse("problem_start_submit", kwargs={
+                'contest': contest.slug, 'slug': part.problem.slug, 'part': part.name})
+        latencies = []
+
+        def hammer(user):
+            client = logged_in_client(user)
+            try:
+                for i in range(requests):
+                    start = time.perf_counter()
+                    client.get(url)
+                    latencies.append(time.perf_counter() - start)
+                    # Finish the attempt so that the next request starts a new one.
+                    Attempt.objects.filter(owner=user, status=Attempt.IN_PROGRESS) \
+                            .update(status=Attempt.INCORRECT, reason=Attempt.WRONG_ANSWER)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=hammer, args=(user,)) for user in users]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        ids = list(Attempt.objects.filter(part=part).values_list('testfileid', flat=True))
+        usage = Counter(ids)
+        results['attempts'] = len(ids)
+        results['requests_per_sec'] = len(latencies) / elapsed
+        results['latency'] = percentiles(latencies)
+        results['distinct_testfiles'] = len(usage)
+        results['duplicates'] = len(ids) - len(usage) if len(ids) <= settings.TESTFILES_PER_PART else None
+        results['max_per_testfile'] = max(usage.values()) if usage else 0
+        results['min_per_testfile'] = min(usage.values()) if usage else 0
+    return results
+
+@suite("scoreboard")
+def scoreboard(options):
+    """
+    Requests/sec of the scoreboard when every request rebuilds it (as before
+    it was cached), when the cached table is reused, and when the browser
+    revalidates with its ETag.
+    """
+    requests = options.get('requests') or 50
+    results = OrderedDict()
+
+    with test_database():
+        contest = create_contest("bench-scoreboard", options.get('problems') or 10, options.get('parts') or 3)
+        users = create_users(contest, options.get('teams') or 300)
+        seed_best_scores(contest, users)
+        url = reverse("scoreboard", kwargs={'contest': contest.slug})
+        client = Client()
+
+        results['rebuilt'] = measure(lambda: client.get(url), requests, before=lambda: bump_version(contest.id))
+        results['cached'] = measure(lambda: client.get(url), requests)
+        etag = client.get(url)['ETag']
+        results['not_modified'] = measure(lambda: client.get(url, HTTP_IF_NONE_MATCH=etag), requests)
+    return results
+
+@suite("views")
+def views(options):
+    """
+    Latency and query counts of the contest hot paths against a synthetic
+    contest with --teams teams, --problems problems of --parts parts and
+    --attempts judged attempts per team.
+    """
+    requests = options.get('requests') or 30
+    results = OrderedDict()
+
+    with test_database(), secret_dir():
+        contest = create_contest("bench-views", options.get('problems') or 10, options.get('parts') or 3)
+        users = create_users(contest, options.get('teams') or 300)
+        seed_attempts(contest, users, options.get('attempts') or 20)
+        judge = User.objects.create_user("judge", "", "bench")
+        judge.is_staff = True
+        judge.save()
+
+        team = users[0]
+        part = ProblemPart.objects.filter(problem__contest=contest).select_related('problem')[0]
+        kwargs = {'contest': contest.slug, 'slug': part.problem.slug}
+        client = logged_in_client(team)
+        staff = logged_in_client(judge)
+
+        def finish():
+            Attempt.objects.filter(owner=team, status=Attempt.IN_PROGRESS) \
+                    .update(status=Attempt.INCORRECT, reason=Attempt.WRONG_ANSWER)
+
+        state = {}
+        def new_attempt():
+            finish()
+            state['url'] = client.get(reverse("problem_start_submit", kwargs=dict(kwargs, part=part.name)))['Location']
+
+        def upload():
+            output = SimpleUploadedFile("output.txt", b"42\n")
+            return client.post(state['url'], {'outputfile': output})
+
+        scoreboard = reverse("scoreboard", kwargs={'contest': contest.slug})
+        results['scoreboard'] = measure(lambda: client.get(scoreboard), requests,
+                before=lambda: bump_version(contest.id))
+        results['scoreboard_cached'] = measure(lambda: client.get(scoreboard), requests)
+        results['contest'] = measure(lambda: client.get(reverse("contest_home", kwargs={'contest': contest.slug})), requests)
+        results['start_submit'] = measure(
+                lambda: client.get(reverse("problem_start_submit", kwargs=dict(kwargs, part=part.name))),
+                requests, before=finish)
+        results['submit_upload'] = measure(upload, requests, before=new_attempt)
+
+        new_attempt()
+        attempt = Attempt.objects.filter(owner=team, status=Attempt.IN_PROGRESS).select_related('part__problem')[0]
+        path = attempt.get_inputfile_path()
+        os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write("1 2 3\n" * 10000)
+        download = reverse("problem_input_file", kwargs=dict(kwargs, attempt_pk=attempt.id, randomness=attempt.randomness))
+        results['download_inputfile'] = measure(lambda: client.get(download), requests)
+
+        submissions = reverse("submission_list", kwargs={'contest': contest.slug})
+        results['admin_submissions'] = measure(lambda: staff.get(submissions), requests)
+
+        shutil.rmtree(os.path.join(settings.SUBMISSION_DIR, "%d-%s" % (contest.id, contest.slug)), ignore_errors=True)
+    return results
+
+def extra_attempt_indexes():
+    """
+    Names of the SQLite indexes on judge_attempt other than the two
+    foreign-key indexes every table gets.
+    """
+    cursor = connection.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'judge_attempt' AND sql IS NOT NULL")
+    names = []
+    for (name,) in cursor.fetchall():
+        cursor.execute("PRAGMA index_info(%s)" % connection.ops.quote_name(name))
+        columns = [row[2] for row in cursor.fetchall()]
+        if columns not in (['owner_id'], ['part_id']):
+            names.append(name)
+    return names
+
+@suite("indexes")
+def indexes(options):
+    """
+    Times the hot Attempt queries on --teams teams with --attempts attempts
+    each, with the declared indexes and again with only the foreign-key
+    ones. SQLite only.
+    """
+    from judge.management.commands.explain_queries import hot_queries, explain
+    if connection.vendor != 'sqlite':
+        return {'skipped': "SQLite only"}
+
+    requests = options.get('requests') or 30
+    results = OrderedDict()
+    with test_database():
+        contest = create_contest("bench-indexes", options.get('problems') or 10, options.get('parts') or 3)
+        users = create_users(contest, options.get('teams') or 1000)
+        seed_attempts(contest, users, options.get('attempts') or 100)
+        results['attempts'] = Attempt.objects.count()
+
+        def run(label):
+            for name, queryset in hot_queries(contest).items():
+                latencies = []
+                for i in range(requests):
+                    start = time.perf_counter()
+                    list(queryset.all())
+                    latencies.append(time.perf_counter() - start)
+                results.setdefault(name, OrderedDict())[label] = OrderedDict([
+                    ('latency', percentiles(latencies)),
+                    ('plan', explain(queryset)),
+                ])
+
+        run('indexed')
+        cursor = connection.cursor()
+        for name in extra_attempt_indexes():
+            cursor.execute("DROP INDEX %s" % connection.ops.quote_name(name))
+        run('foreign_keys_only')
+    return results
+
+@suite("contention")
+def contention(options):
+    """
+    Write throughput of concurrent contestants each starting an attempt and
+    uploading its answer, against whichever database profile is configured
+    (run it once per JUDGE_DB_ENGINE to compare).
+    """
+    threads = options.get('threads') or 8
+    requests = options.get('requests') or 50
+    results = OrderedDict()
+
+    with test_database():
+        contest = create_contest("bench-contention", parts=threads)
+        users = create_users(contest, threads)
+        parts = list(ProblemPart.objects.filter(problem__contest=contest).select_related('problem'))
+        latencies = {'start_submit': [], 'submit_upload': []}
+        errors = Counter()
+
+        def contestant(user, part):
+            client = logged_in_client(user)
+            url = reverse("problem_start_submit", kwargs={
+                    'contest': contest.slug, 'slug': part.problem.slug, 'part': part.name})
+            try:
+                for i in range(requests):
+                    try:
+                        start = time.perf_counter()
+                        location = client.get(url)['Location']
+                        latencies['start_submit'].append(time.perf_counter() - start)
+                        start = time.perf_counter()
+                        client.post(location, {'outputfile': SimpleUploadedFile("output.txt", b"42\n")})
+                        latencies['submit_upload'].append(time.perf_counter() - start)
+                    except Exception as e:
+                        errors[type(e).__name__] += 1
+                    Attempt.objects.filter(owner=user, status=Attempt.IN_PROGRESS) \
+                            .update(status=Attempt.INCORRECT, reason=Attempt.WRONG_ANSWER)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=contestant, args=pair) for pair in zip(users, parts)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        results['vendor'] = connection.vendor
+        if connection.vendor == 'sqlite':
+            cursor = connection.cursor()
+            cursor.execute("PRAGMA journal_mode")
+            results['journal_mode'] = cursor.fetchone()[0]
+        results['conn_max_age'] = connection.settings_dict.get('CONN_MAX_AGE')
+        results['uploads'] = Attempt.objects.filter(part__problem__contest=contest).exclude(outputfile='').count()
+        results['uploads_per_sec'] = results['uploads'] / elapsed
+        for name, samples in latencies.items():
+            results[name] = percentiles(samples)
+        results['errors'] = dict(errors)
+        shutil.rmtree(os.path.join(settings.SUBMISSION_DIR, "%d-%s" % (contest.id, contest.slug)), ignore_errors=True)
+    return results
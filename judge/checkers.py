@@ -0,0 +1,210 @@
+from collections import Counter, OrderedDict
+from itertools import zip_longest
+import math
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_by_path
+from judge.models import Attempt
+
+CHUNK_SIZE = 1 << 16
+
+CHECKERS = OrderedDict()
+
+def register(cls):
+    CHECKERS[cls.name] = cls
+    return cls
+
+def count_lines(f):
+    """
+    Counts the lines left in a text file, reading it in fixed-size chunks.
+    """
+    count = 0
+    last = "\n"
+    chunk = f.read(CHUNK_SIZE)
+    while chunk:
+        count += chunk.count("\n")
+        last = chunk[-1]
+        chunk = f.read(CHUNK_SIZE)
+    if last != "\n":
+        count += 1
+    return count
+
+class Checker:
+    """
+    Compares a contestant's output with the oracle line by line. Subclasses
+    decide what a line means (normalize) and when two lines agree (match).
+    """
+    name = None
+    cacheable = True
+
+    def __init__(self, arg=""):
+        self.arg = arg
+
+    def normalize(self, line):
+        return line.split()
+
+    def match(self, mine, theirs):
+        return mine == theirs
+
+    def check(self, answer, oracle):
+        """
+        Walks both files together and returns the Attempt reason for the
+        verdict. A different number of lines is a bad submission, even if a
+        line mismatched before that; once a line mismatches the rest of both
+        files is only counted.
+        """
+        normalize = self.normalize
+        for mine, theirs in zip_longest(answer, oracle):
+            if mine is None or theirs is None:
+                return Attempt.BAD_SUBMISSION
+            if not self.match(normalize(mine), normalize(theirs)):
+                if count_lines(answer) != count_lines(oracle):
+                    return Attempt.BAD_SUBMISSION
+                return Attempt.WRONG_ANSWER
+        return Attempt.ACCEPTED
+
+    def prepare(self, oracle):
+        """
+        Normalizes a whole oracle file once, so that it can be cached and
+        handed to check_prepared for every attempt using the same test file.
+        """
+        return [self.normalize(line) for line in oracle]
+
+    def check_prepared(self, answer, expected):
+        normalize = self.normalize
+        total = len(expected)
+        lines = 0
+        for line in answer:
+            if lines >= total:
+                return Attempt.BAD_SUBMISSION
+            if not self.match(normalize(line), expected[lines]):
+                if lines + 1 + count_lines(answer) != total:
+                    return Attempt.BAD_SUBMISSION
+                return Attempt.WRONG_ANSWER
+            lines += 1
+        return Attempt.ACCEPTED if lines == total else Attempt.BAD_SUBMISSION
+
+@register
+class ExactChecker(Checker):
+    name = "exact"
+
+    def normalize(self, line):
+        return line.rstrip("\n")
+
+@register
+class TokenChecker(Checker):
+    name = "token"
+
+@register
+class CaseInsensitiveChecker(Checker):
+    name = "nocase"
+
+    def normalize(self, line):
+        return line.lower().split()
+
+@register
+class FloatChecker(Checker):
+    """
+    Tokens that parse as numbers agree within an absolute or relative
+    tolerance given as the checker argument (default 1e-6).
+    """
+    name = "float"
+
+    def __init__(self, arg=""):
+        super().__init__(arg)
+        self.epsilon = float(arg) if arg else 1e-6
+        if not self.epsilon >= 0:
+            raise ValueError("The tolerance must be a non-negative number, not '%s'." % arg)
+
+    def tokens_match(self, mine, theirs):
+        if mine == theirs:
+            return True
+        try:
+            a, b = float(mine), float(theirs)
+        except ValueError:
+            return False
+        if math.isnan(a) or math.isnan(b):
+            return False
+        return abs(a - b) <= self.epsilon * max(1.0, abs(b))
+
+    def match(self, mine, theirs):
+        return len(mine) == len(theirs) and all(self.tokens_match(a, b) for a, b in zip(mine, theirs))
+
+@register
+class UnorderedChecker(Checker):
+    """
+    Accepts the oracle's lines in any order. Lines are compared by their
+    whitespace-separated tokens, so this checker has to hold one line set.
+    """
+    name = "unordered"
+
+    def prepare(self, oracle):
+        return Counter(" ".join(line.split()) for line in oracle)
+
+    def check(self, answer, oracle):
+        return self.check_prepared(answer, self.prepare(oracle))
+
+    def check_prepared(self, answer, expected):
+        seen = Counter()
+        lines = 0
+        wrong = False
+        for line in answer:
+            lines += 1
+            key = " ".join(line.split())
+            seen[key] += 1
+            if seen[key] > expected[key]:
+                wrong = True
+                lines += count_lines(answer)
+                break
+
+        if lines != sum(expected.values()):
+            return Attempt.BAD_SUBMISSION
+        return Attempt.WRONG_ANSWER if wrong else Attempt.ACCEPTED
+
+@register
+class CustomChecker(Checker):
+    """
+    Delegates to a Python callable named by its dotted path in the checker
+    argument. It receives both open files and returns an Attempt reason, or
+    a boolean for accepted/wrong answer.
+    """
+    name = "custom"
+    cacheable = False
+
+    def __init__(self, arg=""):
+        super().__init__(arg)
+        self.func = import_by_path(arg)
+
+    def check(self, answer, oracle):
+        result = self.func(answer, oracle)
+        if result is True:
+            return Attempt.ACCEPTED
+        if result is False:
+            return Attempt.WRONG_ANSWER
+        return result
+
+_loaded = {}
+
+def load_checker(key):
+    """
+    Returns the checker for a (name, argument) pair. Checkers are built once
+    per process and reused for every attempt that selects them.
+    """
+    if key not in _loaded:
+        name, arg = key
+        _loaded[key] = CHECKERS[name](arg)
+    return _loaded[key]
+
+def checker_error(name, arg):
+    """
+    Why the checker `name` can't be built with `arg`, or None if it can.
+    """
+    if name not in CHECKERS:
+        return "Unknown checker '%s'." % name
+    try:
+        load_checker((name, arg))
+    except (ValueError, ImproperlyConfigured) as e:
+        return str(e)
+    return None
+
+def get_checker(part):
+    return load_checker(part.get_checker())
@@ -0,0 +1,53 @@
+"""
+Per-request state shared by the models and template tags: the time the
+request started and the contests the requesting user has entered, each
+loaded at most once. Set up by judge.middleware.RequestContext; outside a
+request every helper falls back to querying directly.
+"""
+import threading
+from django.utils import timezone
+
+_local = threading.local()
+
+class RequestState:
+    def __init__(self, request):
+        self.user = request.user
+        self.now = timezone.now()
+        self._contest_ids = None
+
+    def contest_ids(self):
+        if self._contest_ids is None:
+            if self.user.is_authenticated():
+                self._contest_ids = set(self.user.contests.values_list('id', flat=True))
+            else:
+                self._contest_ids = set()
+        return self._contest_ids
+
+def begin(request):
+    _local.state = RequestState(request)
+
+def end():
+    _local.state = None
+
+def current():
+    return getattr(_local, 'state', None)
+
+def now():
+    state = current()
+    return state.now if state else timezone.now()
+
+def is_contestant(contest, user):
+    if not user.is_authenticated():
+        return False
+    state = current()
+    if state and state.user.pk == user.pk:
+        return contest.id in state.contest_ids()
+    return contest.contestants.filter(id=user.id).exists()
+
+def forget_contests():
+    """
+    Drops the memoized memberships after the user entered a contest.
+    """
+    state = current()
+    if state:
+        state._contest_ids = None
@@ -0,0 +1,20 @@
+"""
+Per-connection database tuning, applied through the connection_created
+signal once register() is called; judge.models does that when the app
+loads.
+"""
+from django.db.backends.signals import connection_created
+
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Puts file databases in WAL mode, so that readers don't block the one
+    writer and vice versa, with synchronous=NORMAL, which is safe in WAL.
+    The busy timeout itself is the sqlite3 `timeout` option in settings.
+    """
+    if connection.vendor != 'sqlite' or connection.settings_dict['NAME'] in ('', ':memory:'):
+        return
+    connection.connection.execute("PRAGMA journal_mode=WAL")
+    connection.connection.execute("PRAGMA synchronous=NORMAL")
+
+def register():
+    connection_created.connect(configure_sqlite, dispatch_uid="judge.db.configure_sqlite")
@@ -0,0 +1,132 @@
+from collections import deque
+from itertools import islice, zip_longest
+import hashlib
+import io
+import os
+import time
+from django.core.cache import cache
+from judge.checkers import get_checker, CHUNK_SIZE
+
+CONTEXT = 5
+WINDOW = 60
+QUICK_WINDOW = 12
+MAX_LINE = 1000
+SCAN_SECONDS = 5
+CACHE_SECONDS = 600
+
+def read_lines(f):
+    """
+    Yields (head, tail) for every line of `f`: its first MAX_LINE characters
+    and a digest of the rest, or None if nothing was cut off. The rest is
+    read in chunks and dropped, so a huge line is never held in memory.
+    """
+    while True:
+        line = f.readline(MAX_LINE + 1)
+        if not line:
+            return
+        if len(line) <= MAX_LINE or line.endswith("\n"):
+            yield line, None
+            continue
+        tail = hashlib.md5(line[MAX_LINE:].encode())
+        chunk = line
+        while chunk and not chunk.endswith("\n"):
+            chunk = f.readline(CHUNK_SIZE)
+            tail.update(chunk.encode())
+        yield line[:MAX_LINE], tail.digest()
+
+def same(checker, a, b):
+    """
+    Whether two lines from read_lines agree. Past MAX_LINE characters they
+    have to be identical, whatever the checker would say.
+    """
+    return a is not None and b is not None and a[1] == b[1] and \
+            checker.match(checker.normalize(a[0]), checker.normalize(b[0]))
+
+def clip(line):
+    if line is None:
+        return None
+    head, tail = line
+    head = head.rstrip("\n")
+    if tail is not None:
+        return head + " [...]"
+    return head
+
+def mark(tokens, others):
+    """
+    Pairs every token with whether it differs from the token at the same
+    position on the other side.
+    """
+    return [(token, i >= len(others) or others[i] != token) for i, token in enumerate(tokens)]
+
+class Row:
+    def __init__(self, number, theirs, mine, equal):
+        self.number = number + 1
+        self.equal = equal
+        theirs, mine = clip(theirs), clip(mine)
+        if equal or theirs is None or mine is None:
+            self.theirs = None if theirs is None else [(theirs, False)]
+            self.mine = None if mine is None else [(mine, False)]
+        else:
+            self.theirs = mark(theirs.split(), mine.split())
+            self.mine = mark(mine.split(), theirs.split())
+
+def window(theirs, mine, checker, start, size, seek):
+    """
+    Reads both files from line `start` (0-based) and returns up to `size`
+    aligned rows. With `seek`, the window instead begins a few lines before
+    the first mismatch at or after `start`. Only the window is ever held in
+    memory, and seeking gives up after SCAN_SECONDS.
+    """
+    lines = islice(zip_longest(read_lines(theirs), read_lines(mine)), start, None)
+    result = {'rows': [], 'mismatch': None, 'timed_out': False, 'next': None}
+    number = start
+
+    if seek:
+        before = deque(maxlen=CONTEXT)
+        deadline = time.time() + SCAN_SECONDS
+        for a, b in lines:
+            if not same(checker, a, b):
+                result['mismatch'] = number
+                result['rows'] = [Row(n, x, y, True) for n, x, y in before]
+                result['rows'].append(Row(number, a, b, False))
+                number += 1
+                break
+            before.append((number, a, b))
+            number += 1
+            if number % 10000 == 0 and time.time() > deadline:
+                result['timed_out'] = True
+                result['next'] = number
+                return result
+        else:
+            return result
+
+    for a, b in islice(lines, size - len(result['rows'])):
+        result['rows'].append(Row(number, a, b, same(checker, a, b)))
+        number += 1
+
+    if len(result['rows']) == size:
+        result['next'] = number
+    return result
+
+def attempt_diff(attempt, start=0, seek=True, quick=False):
+    """
+    Returns the diff window for an attempt, cached per attempt, file
+    versions and position because judges reopen the same diffs repeatedly.
+    """
+    oracle_path = attempt.get_outputfile_path()
+    answer_path = attempt.outputfile.path if attempt.outputfile else None
+    versions = ":".join("%f" % os.stat(path).st_mtime for path in (answer_path, oracle_path) if path)
+
+    key = "diff:%d:%s:%d:%d:%d" % (attempt.pk, versions, start, seek, quick)
+    result = cache.get(key)
+    if result is None:
+        checker = get_checker(attempt.part)
+        size = QUICK_WINDOW if quick else WINDOW
+        with open(oracle_path, "r", buffering=CHUNK_SIZE) as mine:
+            if answer_path:
+                with open(answer_path, "r", buffering=CHUNK_SIZE) as theirs:
+                    result = window(theirs, mine, checker, start, size, seek)
+            else:
+                result = window(io.StringIO(), mine, checker, start, size, seek)
+        cache.set(key, result, CACHE_SECONDS)
+    return result
@@ -0,0 +1,167 @@
+"""
+Publish/subscribe bus behind the live event streams (see
+views.contest_events). Publishing writes an Event row; in each web process
+one thread tails the table every JUDGE_EVENTS_POLL seconds and hands new
+events to the streams open in that process, so the cost of an idle stream
+is a queue, not a query.
+"""
+from datetime import timedelta
+import json
+import logging
+import queue
+import threading
+import time
+from django.db import connection
+from django.db.models import Max, Q
+from django.utils import timezone
+from judge import settings
+from judge.models import Event
+from judge.scoreboard import team_standing
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE_SECONDS = 15
+STREAM_SECONDS = 600
+RETRY_MS = 3000
+QUEUE_SIZE = 1000
+
+def verdict_event(attempt):
+    return Event(contest_id=attempt.part.problem.contest_id, user_id=attempt.owner_id, kind=Event.VERDICT,
+            data=json.dumps({
+                'attempt': attempt.id,
+                'problem': attempt.part.problem.slug,
+                'part': attempt.part.name,
+                'status': attempt.status,
+                'status_display': attempt.get_status_display(),
+                'score': attempt.score,
+                'reason': attempt.get_reason_display(),
+            }))
+
+def standing_event(contest, user_id):
+    return Event(contest_id=contest.id, kind=Event.STANDING, data=json.dumps(team_standing(contest, user_id)))
+
+def clarification_event(clarification):
+    return Event(contest_id=clarification.problem.contest_id, kind=Event.CLARIFICATION,
+            data=json.dumps({'problem': clarification.problem.slug, 'question': clarification.question}))
+
+def publish(*events):
+    if settings.JUDGE_EVENTS:
+        Event.objects.bulk_create(events)
+
+def publish_result(attempt):
+    """
+    Tells the owner about a new verdict and, unless the scoreboard is
+    frozen, scoreboard viewers about the owner's new standing.
+    """
+    if not settings.JUDGE_EVENTS:
+        return
+    contest = attempt.part.problem.contest
+    if contest.is_frozen():
+        publish(verdict_event(attempt))
+    else:
+        publish(verdict_event(attempt), standing_event(contest, attempt.owner_id))
+
+class Subscription:
+    def __init__(self, contest_id, user_id):
+        self.contest_id = contest_id
+        self.user_id = user_id
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.overflowed = False
+
+    def wants(self, event):
+        return event.contest_id == self.contest_id and event.user_id in (None, self.user_id)
+
+    def put(self, event):
+        # A stream that can't keep up is closed; the browser reconnects
+        # with Last-Event-ID and catches up from the table.
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+class Bus:
+    def __init__(self):
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.last_id = None
+        self.pruned = 0
+
+    def subscribe(self, contest_id, user_id):
+        subscription = Subscription(contest_id, user_id)
+        with self.lock:
+            self.subscriptions.add(subscription)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="judge-events")
+                self.thread.daemon = True
+                self.thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def poll(self):
+        if self.last_id is None:
+            self.last_id = Event.objects.aggregate(Max('id'))['id__max'] or 0
+        events = list(Event.objects.filter(id__gt=self.last_id).order_by('id')[:500])
+        if events:
+            self.last_id = events[-1].id
+            with self.lock:
+                subscriptions = list(self.subscriptions)
+            for event in events:
+                for subscription in subscriptions:
+                    if subscription.wants(event):
+                        subscription.put(event)
+
+        if time.time() - self.pruned > 60:
+            self.pruned = time.time()
+            cutoff = timezone.now() - timedelta(seconds=settings.JUDGE_EVENTS_KEEP)
+            Event.objects.filter(created_at__lt=cutoff).delete()
+        return len(events)
+
+    def run(self):
+        while True:
+            try:
+                if not self.poll():
+                    time.sleep(settings.JUDGE_EVENTS_POLL)
+            except Exception:
+                logger.exception("Polling events failed")
+                connection.close()
+                time.sleep(settings.JUDGE_EVENTS_POLL)
+
+bus = Bus()
+
+def format_event(event):
+    return "id: %d\nevent: %s\ndata: %s\n\n" % (event.id, event.kind, event.data)
+
+def stream(contest_id, user_id, last_id=None):
+    """
+    Yields the Server-Sent Events for one viewer, first replaying what they
+    missed since `last_id`. Streams end after STREAM_SECONDS and the
+    browser reconnects, so none outlive a worker restart for long.
+    """
+    subscription = bus.subscribe(contest_id, user_id)
+    try:
+        yield "retry: %d\n\n" % RETRY_MS
+        if last_id is not None:
+            missed = Event.objects.filter(contest_id=contest_id, id__gt=last_id) \
+                    .filter(Q(user__isnull=True) | Q(user_id=user_id)).order_by('id')[:QUEUE_SIZE]
+            for event in missed:
+                last_id = event.id
+                yield format_event(event)
+        # Don't hold a database connection for an idle stream.
+        connection.close()
+
+        deadline = time.time() + STREAM_SECONDS
+        while time.time() < deadline and not subscription.overflowed:
+            try:
+                event = subscription.queue.get(timeout=KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            if last_id is None or event.id > last_id:
+                last_id = event.id
+                yield format_event(event)
+    finally:
+        bus.unsubscribe(subscription)
@@ -0,0 +1,150 @@
+from collections import OrderedDict
+import mimetypes
+import os
+import re
+import threading
+from django.http import Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+from judge import settings
+
+CHUNK_SIZE = 1 << 16
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+def get_etag(stat):
+    return '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+
+def not_modified(request, etag, mtime):
+    match = request.META.get('HTTP_IF_NONE_MATCH')
+    if match is not None:
+        return match == etag or match == "*"
+    since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return since is not None and int(mtime) <= since
+
+def parse_range(request, etag, size):
+    """
+    Returns the (first, last) byte of a single-range request, None to send
+    the whole file, or False when the range can't be satisfied.
+    """
+    header = request.META.get('HTTP_RANGE')
+    if not header or size == 0:
+        return None
+    if request.META.get('HTTP_IF_RANGE', etag) != etag:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        first, last = max(0, size - int(last)), size - 1
+    else:
+        first, last = int(first), min(int(last) if last else size - 1, size - 1)
+    if first > last:
+        return False
+    return first, last
+
+def read_range(path, first, length):
+    with open(path, "rb") as f:
+        f.seek(first)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+def offload(path):
+    """
+    Hands the file to the front-end server when one is configured through
+    JUDGE_SENDFILE ("xsendfile" for Apache/lighttpd, "nginx" for
+    X-Accel-Redirect), and returns None otherwise.
+    """
+    if settings.JUDGE_SENDFILE == "xsendfile":
+        response = HttpResponse()
+        response['X-Sendfile'] = path
+        return response
+    if settings.JUDGE_SENDFILE == "nginx":
+        relative = os.path.relpath(path, settings.JUDGE_SENDFILE_ROOT)
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = settings.JUDGE_SENDFILE_URL.rstrip("/") + "/" + relative.replace(os.sep, "/")
+        return response
+    return None
+
+def serve_file(request, path, attachment=True, filename=None, content_type=None,
+        encoding=None, private=True, max_age=0, stat=None):
+    """
+    Serves a file with ETag/Last-Modified validation and Cache-Control. The
+    body is offloaded to the front-end server when configured, otherwise it
+    is streamed in chunks, honouring single byte ranges. Callers that know
+    the file's size and mtime can pass them as `stat` to skip the os.stat().
+    """
+    if stat is None:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            raise Http404("File not found")
+
+    etag = get_etag(stat)
+    if not_modified(request, etag, stat.st_mtime):
+        response = HttpResponseNotModified()
+    else:
+        response = offload(path)
+        if response is None:
+            byterange = parse_range(request, etag, stat.st_size) if encoding is None else None
+            if byterange is False:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = "bytes */%d" % stat.st_size
+                return response
+            if byterange:
+                first, last = byterange
+                response = StreamingHttpResponse(read_range(path, first, last - first + 1), status=206)
+                response['Content-Range'] = "bytes %d-%d/%d" % (first, last, stat.st_size)
+                response['Content-Length'] = last - first + 1
+            else:
+                response = StreamingHttpResponse(read_range(path, 0, stat.st_size))
+                response['Content-Length'] = stat.st_size
+
+        response['Content-Type'] = content_type or mimetypes.guess_type(filename or path)[0] or "application/octet-stream"
+        if encoding:
+            response['Content-Encoding'] = encoding
+        else:
+            response['Accept-Ranges'] = "bytes"
+        disposition = "attachment" if attachment else "inline"
+        response['Content-Disposition'] = '%s; filename="%s"' % (disposition, filename or os.path.basename(path))
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    patch_cache_control(response, max_age=max_age, **{'private' if private else 'public': True})
+    return response
+
+class TextCache:
+    """
+    Small in-process cache of text files, keyed by path and revalidated
+    against the file's mtime and size on every read.
+    """
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def read(self, path):
+        stat = os.stat(path)
+        version = (stat.st_mtime, stat.st_size)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry and entry[0] == version:
+                self.entries.move_to_end(path)
+                return entry[1]
+
+        with open(path, "r") as f:
+            text = f.read()
+
+        with self.lock:
+            self.entries[path] = (version, text)
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+        return text
+
+sample_cache = TextCache()
@@ -0,0 +1,149 @@
+"""
+Scoreboard history. Every change of a BestScore row is appended to a
+per-contest log of fixed-size binary records, so that the standings at
+any moment can be rebuilt by one sequential read of the file instead of
+replaying the Attempt history.
+"""
+from datetime import datetime
+from itertools import groupby
+import csv
+import os
+import struct
+from django.utils import timezone
+from judge import settings
+from judge.models import Attempt, BestScore
+from judge.ranking import Ranking, standing
+from judge.scoreboard import ranked_rows
+
+# time, user id, part id, score, solved_at, failures, improved_at; times
+# are Unix timestamps with 0 for "never".
+RECORD = struct.Struct("<dIIidid")
+COLUMNS = ('time', 'user', 'part', 'score', 'solved_at', 'failures', 'improved_at')
+
+def get_path(contest_id):
+    return os.path.join(settings.JUDGE_HISTORY_DIR, "%d.bin" % contest_id)
+
+def to_timestamp(value):
+    return value.timestamp() if value else 0.0
+
+def to_datetime(value):
+    return datetime.fromtimestamp(value, timezone.utc) if value else None
+
+def pack(when, user_id, part_id, score, solved_at, failures, improved_at):
+    return RECORD.pack(when, user_id, part_id, score, to_timestamp(solved_at), failures, to_timestamp(improved_at))
+
+def append(contest_id, data):
+    # A single O_APPEND write, so records from concurrent processes never
+    # interleave.
+    os.makedirs(settings.JUDGE_HISTORY_DIR, exist_ok=True)
+    fd = os.open(get_path(contest_id), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+def changes(rows):
+    """
+    Folds one team's (score, status, reason, created_at) rows on one part,
+    in submission order, and yields (created_at, (score, solved_at,
+    failures, improved_at)) at each judged attempt where the tally of the
+    attempts so far changed.
+    """
+    seen, previous = [], None
+    for row in rows:
+        seen.append(row)
+        if row[1] == Attempt.IN_PROGRESS:
+            continue
+        score, solved_at, attempts, failures, improved_at = BestScore.tally(seen)
+        if (score, solved_at, failures, improved_at) != previous:
+            previous = (score, solved_at, failures, improved_at)
+            yield row[3], previous
+
+def record(contest_id, user_id, part_id, since):
+    """
+    Logs a team's tallies on a part from its attempt submitted at `since`
+    on, each stamped with the submission time of the attempt it follows, as
+    backfill() writes them. An attempt judged late, or rejudged, so also
+    rewrites the records of the attempts after it rather than carrying
+    their results back to its own time.
+    """
+    rows = Attempt.objects.filter(owner_id=user_id, part_id=part_id).order_by('created_at') \
+            .values_list('score', 'status', 'reason', 'created_at')
+    data = b"".join(pack(to_timestamp(created_at), user_id, part_id, *state)
+            for created_at, state in changes(rows) if created_at >= since)
+    if data:
+        append(contest_id, data)
+
+def read(contest_id):
+    """
+    Yields the contest's records as tuples in COLUMNS order. A record cut
+    short by a crash mid-write is ignored.
+    """
+    try:
+        with open(get_path(contest_id), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return iter(())
+    return RECORD.iter_unpack(memoryview(data)[:len(data) - len(data) % RECORD.size])
+
+def state_at(contest_id, when):
+    """
+    Returns {(user id, part id): (score, solved_at, failures, improved_at)}
+    as it was at Unix time `when`.
+    """
+    latest = {}
+    for stamp, user_id, part_id, score, solved_at, failures, improved_at in read(contest_id):
+        if stamp <= when:
+            latest[(user_id, part_id)] = (score, solved_at, failures, improved_at)
+    return dict((key, (score, to_datetime(solved_at), failures, to_datetime(improved_at)))
+            for key, (score, solved_at, failures, improved_at) in latest.items())
+
+def backfill(contest):
+    """
+    Rewrites the contest's log from its Attempt history, stamping each
+    change with the submission time of the attempt that caused it.
+    """
+    rows = Attempt.objects.filter(part__problem__contest=contest) \
+            .order_by('owner', 'part', 'created_at') \
+            .values_list('owner', 'part', 'score', 'status', 'reason', 'created_at')
+    records = []
+    for (user_id, part_id), group in groupby(rows.iterator(), key=lambda row: row[:2]):
+        for created_at, state in changes(row[2:] for row in group):
+            records.append((to_timestamp(created_at), pack(to_timestamp(created_at), user_id, part_id, *state)))
+    records.sort(key=lambda entry: entry[0])
+
+    os.makedirs(settings.JUDGE_HISTORY_DIR, exist_ok=True)
+    path = get_path(contest.id)
+    with open(path + ".tmp", "wb") as f:
+        for stamp, data in records:
+            f.write(data)
+    os.rename(path + ".tmp", path)
+    return len(records)
+
+def build_scoreboard(contest, when):
+    """
+    The scoreboard as it stood at Unix time `when`, like
+    scoreboard.build_scoreboard.
+    """
+    problems = list(contest.problems.prefetch_related('parts'))
+    state = state_at(contest.id, when)
+    by_user = {}
+    for (user_id, part_id), row in state.items():
+        by_user.setdefault(user_id, []).append(row)
+    ranking = Ranking()
+    for user_id, rows in by_user.items():
+        ranking.update(user_id, standing(contest, rows))
+    best = dict((key, row[0]) for key, row in state.items())
+    return problems, ranked_rows(contest, problems, best, ranking)
+
+def write_csv(contest_id, out):
+    """
+    Writes the contest's log to a text stream as CSV with ISO timestamps,
+    one row per change.
+    """
+    writer = csv.writer(out)
+    writer.writerow(COLUMNS)
+    for stamp, user_id, part_id, score, solved_at, failures, improved_at in read(contest_id):
+        writer.writerow([to_datetime(stamp).isoformat(), user_id, part_id, score,
+                solved_at and to_datetime(solved_at).isoformat(), failures,
+                improved_at and to_datetime(improved_at).isoformat()])
@@ -0,0 +1,164 @@
+"""
+Opt-in request instrumentation, enabled with JUDGE_INSTRUMENT and recorded
+by judge.middleware.Instrument. For every request it notes, under the URL
+name that served it, the latency, the number of SQL queries and the time
+spent in them, template render time and time spent scoring. Samples go
+into a fixed-size ring per URL name; appending to a deque and setdefault()
+are atomic, so recording needs no lock. Each process periodically dumps
+its rings to JUDGE_INSTRUMENT_DIR, where the staff endpoint and
+`manage.py view_stats` aggregate them.
+"""
+from collections import deque, OrderedDict
+from functools import wraps
+import cProfile
+import io
+import itertools
+import json
+import os
+import pstats
+import threading
+import time
+from django.db import connection
+from judge import settings
+
+FIELDS = ('latency', 'queries', 'sql', 'render', 'score')
+PROFILES_KEPT = 5
+
+_rings = {}
+_profiles = {}
+_counter = itertools.count(1)
+_local = threading.local()
+_flushed = [0]
+
+class Sample:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.timings = dict.fromkeys(FIELDS[3:], 0.0)
+        self.active = set()
+        self.profiler = None
+        self.debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        self.offset = len(connection.queries)
+
+def timed(field):
+    """
+    Adds the time spent in the decorated function to `field` of the
+    current request's sample. Nested calls are only counted once.
+    """
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            sample = getattr(_local, 'sample', None)
+            if sample is None or field in sample.active:
+                return func(*args, **kwargs)
+            sample.active.add(field)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                sample.timings[field] += time.perf_counter() - start
+                sample.active.discard(field)
+        return wrapper
+    return decorate
+
+def install():
+    from django.template.base import Template
+    if not hasattr(Template.render, '__wrapped__'):
+        Template.render = timed('render')(Template.render)
+
+def begin():
+    sample = _local.sample = Sample()
+    every = settings.JUDGE_INSTRUMENT_PROFILE
+    if every and next(_counter) % every == 0:
+        sample.profiler = cProfile.Profile()
+        sample.profiler.enable()
+
+def finish(request):
+    sample = getattr(_local, 'sample', None)
+    if sample is None:
+        return
+    _local.sample = None
+    latency = time.perf_counter() - sample.start
+    if sample.profiler:
+        sample.profiler.disable()
+
+    queries = connection.queries[sample.offset:]
+    connection.use_debug_cursor = sample.debug_cursor
+    match = getattr(request, 'resolver_match', None)
+    name = match.url_name if match and match.url_name else "unresolved"
+
+    record = (latency, len(queries), sum(float(query['time']) for query in queries),
+            sample.timings['render'], sample.timings['score'])
+    ring = _rings.get(name)
+    if ring is None:
+        ring = _rings.setdefault(name, deque(maxlen=settings.JUDGE_INSTRUMENT_RING))
+    ring.append(record)
+
+    if sample.profiler:
+        stream = io.StringIO()
+        pstats.Stats(sample.profiler, stream=stream).sort_stats('cumulative').print_stats(40)
+        profiles = _profiles.get(name)
+        if profiles is None:
+            profiles = _profiles.setdefault(name, deque(maxlen=PROFILES_KEPT))
+        profiles.append({'time': time.time(), 'path': request.path, 'latency': latency, 'stats': stream.getvalue()})
+
+    if time.time() - _flushed[0] > settings.JUDGE_INSTRUMENT_FLUSH:
+        flush()
+
+def flush():
+    """
+    Writes this process's rings and profiles to JUDGE_INSTRUMENT_DIR.
+    """
+    _flushed[0] = time.time()
+    os.makedirs(settings.JUDGE_INSTRUMENT_DIR, exist_ok=True)
+    data = {
+        'pid': os.getpid(),
+        'time': _flushed[0],
+        'samples': dict((name, list(ring)) for name, ring in list(_rings.items())),
+        'profiles': dict((name, list(profiles)) for name, profiles in list(_profiles.items())),
+    }
+    path = os.path.join(settings.JUDGE_INSTRUMENT_DIR, "%d.json" % os.getpid())
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.rename(path + ".tmp", path)
+
+def load(max_age=None):
+    """
+    Reads the dumps of every process, skipping those older than `max_age`
+    seconds. Returns (samples, profiles), both keyed by URL name.
+    """
+    samples, profiles = {}, {}
+    try:
+        names = os.listdir(settings.JUDGE_INSTRUMENT_DIR)
+    except OSError:
+        return samples, profiles
+    for filename in names:
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(settings.JUDGE_INSTRUMENT_DIR, filename)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if max_age and data['time'] < time.time() - max_age:
+            continue
+        for name, records in data['samples'].items():
+            samples.setdefault(name, []).extend(records)
+        for name, entries in data['profiles'].items():
+            profiles.setdefault(name, []).extend(entries)
+    for entries in profiles.values():
+        entries.sort(key=lambda entry: entry['time'])
+    return samples, profiles
+
+def summarize(samples):
+    """
+    Returns {url name: {count, field: percentiles}}, slowest p90 first.
+    """
+    from judge.util import percentiles
+    summary = OrderedDict()
+    for name, records in samples.items():
+        entry = OrderedDict([('count', len(records))])
+        for i, field in enumerate(FIELDS):
+            entry[field] = percentiles([record[i] for record in records])
+        summary[name] = entry
+    return OrderedDict(sorted(summary.items(), key=lambda item: -item[1]['latency']['p90']))
@@ -0,0 +1,101 @@
+from collections import defaultdict
+from datetime import timedelta
+import logging
+from django.db.models import F, Q
+from django.utils import timezone
+from judge import settings
+from judge.models import Attempt, JudgeTask
+from judge.util import score, save_result, percentiles
+
+logger = logging.getLogger(__name__)
+
+def enqueue(attempt):
+    return JudgeTask.objects.create(attempt=attempt)
+
+def unleased(now):
+    return JudgeTask.objects.filter(finished_at__isnull=True) \
+            .filter(Q(leased_until__isnull=True) | Q(leased_until__lt=now))
+
+def available(now):
+    return unleased(now).filter(tries__lt=settings.JUDGE_QUEUE_MAX_TRIES)
+
+def abandoned(now):
+    """
+    Tasks whose every try ended with the lease running out, i.e. whose
+    worker died while judging them, so process() never got to fail them.
+    """
+    return unleased(now).filter(tries__gte=settings.JUDGE_QUEUE_MAX_TRIES)
+
+def claim(worker, batch=10):
+    """
+    Leases the oldest available task to the given worker. The lease is taken
+    with a conditional UPDATE, so two workers can never hold the same task;
+    a worker that dies simply lets its lease run out. Abandoned tasks met
+    on the way are failed.
+    """
+    now = timezone.now()
+    lease = now + timedelta(seconds=settings.JUDGE_QUEUE_LEASE)
+    for pk in abandoned(now).values_list('pk', flat=True)[:batch]:
+        if abandoned(now).filter(pk=pk).update(leased_until=lease, leased_by=worker):
+            task = JudgeTask.objects.select_related('attempt__part__problem').get(pk=pk)
+            logger.error("Giving up on attempt #%d: the worker died on each of its %d tries", task.attempt_id, task.tries)
+            fail(task)
+
+    for pk in available(now).values_list('pk', flat=True)[:batch]:
+        claimed = available(now).filter(pk=pk) \
+                .update(leased_until=lease, leased_by=worker, tries=F('tries') + 1)
+        if claimed:
+            return JudgeTask.objects.select_related('attempt__part__problem').get(pk=pk)
+    return None
+
+def fail(task):
+    """
+    Gives up on a task that kept failing: the attempt is rejected with
+    JUDGE_ERROR, which costs no penalty and shows up in the admin
+    submission list, and `manage.py rejudge` picks it up again. An attempt
+    that was judged after all is left alone.
+    """
+    attempt = task.attempt
+    if attempt.status == Attempt.IN_PROGRESS:
+        attempt.status, attempt.reason, attempt.score = Attempt.INCORRECT, Attempt.JUDGE_ERROR, 0
+        save_result(attempt)
+    JudgeTask.objects.filter(pk=task.pk).update(finished_at=timezone.now(), reason=attempt.reason)
+
+def process(task):
+    """
+    Scores the attempt behind a leased task and marks the task finished.
+    Scoring is idempotent, so a task redelivered after a crash is harmless.
+    """
+    try:
+        score(task.attempt)
+    except Exception:
+        logger.exception("Could not score attempt #%d", task.attempt_id)
+        if task.tries >= settings.JUDGE_QUEUE_MAX_TRIES:
+            logger.error("Giving up on attempt #%d after %d tries", task.attempt_id, task.tries)
+            fail(task)
+        else:
+            JudgeTask.objects.filter(pk=task.pk).update(leased_until=None, leased_by="")
+        return
+
+    JudgeTask.objects.filter(pk=task.pk) \
+            .update(finished_at=timezone.now(), reason=task.attempt.reason)
+
+def metrics(window=3600):
+    """
+    Returns the queue depth and, per verdict, the latency percentiles in
+    seconds from upload to verdict over the last `window` seconds.
+    """
+    now = timezone.now()
+    latencies = defaultdict(list)
+    finished = JudgeTask.objects.filter(finished_at__gte=now - timedelta(seconds=window)) \
+            .values_list('reason', 'enqueued_at', 'finished_at')
+    for reason, enqueued_at, finished_at in finished:
+        latencies[reason].append((finished_at - enqueued_at).total_seconds())
+
+    reasons = dict(Attempt.CHOICES_REASON)
+    return {
+        'depth': JudgeTask.objects.filter(finished_at__isnull=True).count(),
+        'leased': JudgeTask.objects.filter(finished_at__isnull=True, leased_until__gte=now).count(),
+        'latency': dict((reasons.get(reason, "Failed"), dict(percentiles(samples), count=len(samples)))
+                for reason, samples in latencies.items()),
+    }
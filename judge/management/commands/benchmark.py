@@ -0,0 +1,60 @@
+from optparse import make_option
+from datetime import datetime
+import json
+import subprocess
+from django.core.management.base import BaseCommand, CommandError
+from judge import settings
+from judge.benchmarks import SUITES
+
+class Command(BaseCommand):
+    args = "<suite suite ...>"
+    help = "Runs benchmark suites and prints (or saves) the results as JSON."
+    option_list = BaseCommand.option_list + (
+        make_option('--json', dest='json', default=None,
+            help="Write the results to this file."),
+        make_option('--size', dest='size', type='int', default=None,
+            help="Size in megabytes of generated output files."),
+        make_option('--baseline', action='store_true', dest='baseline', default=False,
+            help="Also run the previous implementation where a suite has one."),
+        make_option('--threads', dest='threads', type='int', default=None,
+            help="Number of concurrent clients."),
+        make_option('--requests', dest='requests', type='int', default=None,
+            help="Number of requests per client."),
+        make_option('--teams', dest='teams', type='int', default=None,
+            help="Number of teams in the generated contest."),
+        make_option('--problems', dest='problems', type='int', default=None,
+            help="Number of problems in the generated contest."),
+        make_option('--parts', dest='parts', type='int', default=None,
+            help="Number of parts per problem."),
+        make_option('--attempts', dest='attempts', type='int', default=None,
+            help="Number of past attempts per team."),
+    )
+
+    def commit(self):
+        try:
+            return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=settings.BASE_DIR,
+                    stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def handle(self, *names, **options):
+        names = names or list(SUITES)
+        for name in names:
+            if name not in SUITES:
+                raise CommandError("Unknown suite '%s'. Available: %s" % (name, ", ".join(SUITES)))
+
+        results = {'_meta': {
+            'commit': self.commit(),
+            'time': datetime.now().isoformat(),
+            'options': dict((key, options.get(key)) for key in
+                    ('size', 'threads', 'requests', 'teams', 'problems', 'parts', 'attempts')),
+        }}
+        for name in names:
+            self.stderr.write("Running %s..." % name)
+            results[name] = SUITES[name](options)
+
+        output = json.dumps(results, indent=2, default=str)
+        if options['json']:
+            with open(options['json'], "w") as f:
+                f.write(output)
+        self.stdout.write(output)
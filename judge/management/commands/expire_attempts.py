@@ -0,0 +1,37 @@
+from optparse import make_option
+from datetime import timedelta
+import time
+from django.core.management.base import BaseCommand
+from judge.models import Attempt
+from judge.util import expire_attempts
+
+class Command(BaseCommand):
+    help = "Times out pending attempts whose deadline has passed."
+    option_list = BaseCommand.option_list + (
+        make_option('--interval', dest='interval', type='float', default=0,
+            help="Keep running, sweeping every INTERVAL seconds."),
+    )
+
+    def backfill(self):
+        """
+        Attempts created before expires_at existed get their deadline
+        computed once, so that the indexed sweep picks them up.
+        """
+        missing = Attempt.objects.filter(status=Attempt.IN_PROGRESS, expires_at__isnull=True) \
+                .select_related('part__problem')
+        for attempt in missing:
+            deadline = attempt.created_at + timedelta(seconds=attempt.part.problem.time_limit)
+            Attempt.objects.filter(pk=attempt.pk).update(expires_at=deadline)
+
+    def sweep(self):
+        self.backfill()
+        expired = expire_attempts()
+        if expired:
+            self.stdout.write("Expired %d attempt(s)." % expired)
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        self.sweep()
+        while interval > 0:
+            time.sleep(interval)
+            self.sweep()
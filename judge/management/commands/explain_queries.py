@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from judge.models import Attempt, Contest
+from judge.util import expirable
+from judge.views import filter_submissions
+
+def hot_queries(contest):
+    """
+    The Attempt queries behind start_submit, BestScore.refresh, the
+    submissions pages and the expiry sweep, for one of the contest's
+    attempts (or made-up ids when it has none).
+    """
+    attempt = Attempt.objects.filter(part__problem__contest=contest).select_related('part').first()
+    owner_id, part_id, problem_id = (attempt.owner_id, attempt.part_id, attempt.part.problem_id) if attempt else (1, 1, 1)
+    return OrderedDict([
+        ('start_submit', Attempt.objects.filter(owner_id=owner_id, part_id=part_id, status=Attempt.IN_PROGRESS)[:1]),
+        ('best_score_refresh', Attempt.objects.filter(owner_id=owner_id, part_id=part_id)
+                .values_list('score', 'status', 'reason', 'created_at')),
+        ('problem_submissions', Attempt.objects.filter(owner_id=owner_id, part__problem_id=problem_id)),
+        ('expire_sweep', expirable()),
+        ('admin_submissions', filter_submissions(contest, {})[:21]),
+        ('admin_submissions_status', filter_submissions(contest, {'status': str(Attempt.CORRECT)})[:21]),
+    ])
+
+def explain(queryset):
+    sql, params = queryset.query.sql_with_params()
+    prefix = "EXPLAIN QUERY PLAN " if connection.vendor == 'sqlite' else "EXPLAIN "
+    cursor = connection.cursor()
+    cursor.execute(prefix + sql, params)
+    return [" ".join(str(column) for column in row) for row in cursor.fetchall()]
+
+def scans_attempts(plan):
+    """
+    Whether a SQLite plan reads judge_attempt without any index.
+    """
+    return any(("SCAN TABLE judge_attempt" in line or line.endswith("SCAN judge_attempt"))
+            and "INDEX" not in line for line in plan)
+
+class Command(BaseCommand):
+    args = "<contest slug>"
+    help = "Prints the query plans of the hot Attempt queries."
+    option_list = BaseCommand.option_list + (
+        make_option('--check', action='store_true', dest='check', default=False,
+            help="Fail if a query reads the attempts table without an index (SQLite only)."),
+    )
+
+    def handle(self, *args, **options):
+        contest = Contest.objects.filter(slug=args[0]).first() if args else Contest.objects.first()
+        if contest is None:
+            raise CommandError("No contest to explain queries for.")
+
+        failed = []
+        for name, queryset in hot_queries(contest).items():
+            plan = explain(queryset)
+            self.stdout.write("%s:\n    %s" % (name, "\n    ".join(plan)))
+            if connection.vendor == 'sqlite' and scans_attempts(plan):
+                failed.append(name)
+
+        if options['check'] and failed:
+            raise CommandError("Unindexed scans of judge_attempt: %s" % ", ".join(failed))
@@ -0,0 +1,32 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from judge import history
+from judge.models import Contest
+
+class Command(BaseCommand):
+    args = "<contest slug>"
+    help = "Exports a contest's scoreboard history log as CSV, or rebuilds it from the attempts."
+    option_list = BaseCommand.option_list + (
+        make_option('--backfill', action='store_true', dest='backfill', default=False,
+            help="Rebuild the log from the Attempt history first (for contests run without it)."),
+        make_option('--output', dest='output', default=None,
+            help="Write to this file instead of standard output."),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage: manage.py export_history <contest slug>")
+        try:
+            contest = Contest.objects.get(slug=args[0])
+        except Contest.DoesNotExist:
+            raise CommandError("No contest with slug '%s'." % args[0])
+
+        if options['backfill']:
+            count = history.backfill(contest)
+            self.stderr.write("Wrote %d record(s)." % count)
+
+        if options['output']:
+            with open(options['output'], "w", newline="") as out:
+                history.write_csv(contest.id, out)
+        else:
+            history.write_csv(contest.id, self.stdout)
@@ -0,0 +1,175 @@
+from optparse import make_option
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import os
+import subprocess
+import sys
+import time
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from judge import settings
+from judge.models import Contest, ProblemPart, get_testfile_path
+
+def find_script(problem_slug, part_name, name):
+    """
+    Looks for PROBLEM_DIR/<problem>/<part>/<name>, then the problem-wide
+    PROBLEM_DIR/<problem>/<name>, with or without a .py extension.
+    """
+    for directory in (os.path.join(settings.PROBLEM_DIR, problem_slug, part_name),
+            os.path.join(settings.PROBLEM_DIR, problem_slug)):
+        for filename in (name, name + ".py"):
+            path = os.path.join(directory, filename)
+            if os.path.isfile(path):
+                return path
+    return None
+
+def command_for(script):
+    return [sys.executable, script] if script.endswith(".py") else [script]
+
+def derive_seed(seed, problem_slug, part_name, number):
+    """
+    The seed of one test file depends only on the base seed and which file
+    it is, so any subset can be regenerated identically in any order.
+    """
+    key = "%s:%s:%s:%d" % (seed, problem_slug, part_name, number)
+    return int(hashlib.sha1(key.encode()).hexdigest()[:15], 16)
+
+def run(command, stdin, path, timeout):
+    """
+    Runs a command with its output going to `path`.
+    """
+    with open(path, "wb") as out:
+        subprocess.run(command, stdin=stdin, stdout=out, stderr=subprocess.PIPE,
+                timeout=timeout, check=True)
+
+def generate(job):
+    """
+    Produces one input with the generator (called as `generator <part>
+    <number> <seed>`) and its oracle output by feeding it to the reference
+    solution. Both are written under temporary names and renamed into place
+    only once both succeeded, so an existing pair is either kept or replaced
+    whole. Returns None, or an error message.
+    """
+    generator, solution, part_name, number, seed, input_path, output_path, timeout = job
+    staged_input = "%s.tmp-%d" % (input_path, os.getpid())
+    staged_output = "%s.tmp-%d" % (output_path, os.getpid())
+    steps = (
+        ("generator", command_for(generator) + [part_name, str(number), str(seed)], None, staged_input, input_path),
+        ("solution", command_for(solution), staged_input, staged_output, output_path),
+    )
+    try:
+        for label, command, source, staged, path in steps:
+            try:
+                if source is None:
+                    run(command, subprocess.DEVNULL, staged, timeout)
+                else:
+                    with open(source, "rb") as stdin:
+                        run(command, stdin, staged, timeout)
+            except subprocess.CalledProcessError as e:
+                return "%s: %s exited with %d: %s" % (path, label, e.returncode,
+                        e.stderr.decode(errors="replace").strip()[-200:])
+            except subprocess.TimeoutExpired:
+                return "%s: %s timed out after %ss" % (path, label, timeout)
+            except OSError as e:
+                return "%s: %s: %s" % (path, label, e)
+
+        # The old output goes first and the new one comes last, so an
+        # interrupted swap leaves the pair incomplete and it is redone.
+        try:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            os.rename(staged_input, input_path)
+            os.rename(staged_output, output_path)
+        except OSError as e:
+            return "%s: %s" % (output_path, e)
+        return None
+    finally:
+        for path in (staged_input, staged_output):
+            if os.path.exists(path):
+                os.remove(path)
+
+class Command(BaseCommand):
+    args = "<contest slug>"
+    help = "Generates test inputs and their oracle outputs for a contest's parts with a generator and a reference solution."
+    option_list = BaseCommand.option_list + (
+        make_option('--problem', dest='problem', default=None,
+            help="Only this problem (slug)."),
+        make_option('--part', dest='part', default=None,
+            help="Only parts with this name."),
+        make_option('--generator', dest='generator', default=None,
+            help="Generator script; by default PROBLEM_DIR/<problem>[/<part>]/generator."),
+        make_option('--solution', dest='solution', default=None,
+            help="Reference solution; by default PROBLEM_DIR/<problem>[/<part>]/solution."),
+        make_option('--count', dest='count', type='int', default=settings.TESTFILES_PER_PART),
+        make_option('--seed', dest='seed', default="0",
+            help="Base seed; the same seed always produces the same files."),
+        make_option('--workers', dest='workers', type='int', default=os.cpu_count() or 4),
+        make_option('--timeout', dest='timeout', type='float', default=60,
+            help="Seconds each generator or solution run may take."),
+        make_option('--force', action='store_true', dest='force', default=False,
+            help="Regenerate files that already exist instead of resuming."),
+        make_option('--prepare', action='store_true', dest='prepare', default=False,
+            help="Run prepare_contest once everything is generated."),
+    )
+
+    def jobs(self, parts, options):
+        for part in parts:
+            slug = part.problem.slug
+            generator = options['generator'] or find_script(slug, part.name, "generator")
+            solution = options['solution'] or find_script(slug, part.name, "solution")
+            if not generator or not solution:
+                raise CommandError("%s/%s: no generator or reference solution found under %s." %
+                        (slug, part.name, settings.PROBLEM_DIR))
+
+            for kind in ("inputs", "outputs"):
+                os.makedirs(os.path.dirname(get_testfile_path(kind, slug, part.name, 0)), exist_ok=True)
+            for number in range(options['count']):
+                input_path = get_testfile_path("inputs", slug, part.name, number)
+                output_path = get_testfile_path("outputs", slug, part.name, number)
+                # The output is written last, so its presence means the pair is done.
+                if not options['force'] and os.path.exists(output_path) and os.path.exists(input_path):
+                    continue
+                yield (generator, solution, part.name, number, derive_seed(options['seed'], slug, part.name, number),
+                        input_path, output_path, options['timeout'])
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage: manage.py generate_tests <contest slug>")
+        try:
+            contest = Contest.objects.get(slug=args[0])
+        except Contest.DoesNotExist:
+            raise CommandError("No contest with slug '%s'." % args[0])
+
+        parts = ProblemPart.objects.filter(problem__contest=contest).select_related('problem')
+        if options['problem']:
+            parts = parts.filter(problem__slug=options['problem'])
+        if options['part']:
+            parts = parts.filter(name=options['part'])
+        jobs = list(self.jobs(parts, options))
+        total = len(parts) * options['count']
+        self.stdout.write("%d of %d pair(s) to generate, %d already done." % (len(jobs), total, total - len(jobs)))
+
+        # The work happens in the generator and solution processes, so
+        # threads are enough to keep every core busy.
+        errors = []
+        done = 0
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            for future in as_completed([pool.submit(generate, job) for job in jobs]):
+                error = future.result()
+                if error:
+                    errors.append(error)
+                done += 1
+                if done % 500 == 0 and int(options['verbosity']) > 1:
+                    self.stdout.write("... %d/%d, %.1f pairs/s" % (done, len(jobs), done / (time.time() - start)))
+
+        elapsed = max(time.time() - start, 1e-6)
+        self.stdout.write("Generated %d pair(s) in %.1fs (%.1f pairs/s)." %
+                (len(jobs) - len(errors), elapsed, len(jobs) / elapsed))
+        for error in errors[:20]:
+            self.stderr.write(error)
+        if errors:
+            raise CommandError("%d pair(s) failed; rerun to retry them." % len(errors))
+
+        if options['prepare']:
+            call_command('prepare_contest', contest.slug, count=options['count'])
@@ -0,0 +1,330 @@
+from optparse import make_option
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+import json
+import os
+import re
+import shutil
+import sys
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+from django.core.files import File
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from judge import settings
+from judge.models import Contest, Problem, ProblemPart
+from judge.checkers import CHUNK_SIZE, checker_error
+
+# An archive holds a contest.json manifest:
+#   {"name", "slug", "begin_at", "end_at", "description", "freeze_at"?,
+#    "problems": [{"name", "slug", "order", "time_limit", "checker"?,
+#      "checker_arg"?, "pdf", "sample_input", "sample_output",
+#      "parts": [{"name", "points", "checker"?, "checker_arg"?}]}]}
+# where pdf and the samples are paths inside the archive and order is the
+# problem's letter ("A"), plus the test files as
+# <problem slug>/inputs/<part>-<n>.in and .../outputs/<part>-<n>.out.
+MANIFEST = "contest.json"
+TESTFILE_RE = re.compile(r'^(?P<problem>[-\w]+)/(?P<kind>inputs|outputs)/(?P<part>[^/]+)-(?P<number>\d+)\.(?P<ext>in|out)$')
+EXTENSIONS = {'inputs': "in", 'outputs': "out"}
+
+# The keys create() reads from each level of the manifest, with the type
+# their value must have.
+CONTEST_KEYS = (('name', str), ('slug', str), ('begin_at', str), ('end_at', str), ('problems', list))
+PROBLEM_KEYS = (('name', str), ('slug', str), ('order', str), ('time_limit', int),
+        ('pdf', str), ('sample_input', str), ('sample_output', str), ('parts', list))
+PART_KEYS = (('name', str), ('points', int))
+
+# Members up to this size are read into memory and written by the pool;
+# larger ones are copied straight from the archive.
+BUFFERED_BYTES = 8 * 1024 * 1024
+
+def members(path):
+    """
+    Yields (name, size, file object) for every regular file of a zip or tar
+    archive ("-" reads a tar from standard input), in archive order and
+    without extracting anything first.
+    """
+    if path != "-" and zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.filename.endswith("/"):
+                    with archive.open(info) as f:
+                        yield info.filename, info.file_size, f
+        return
+
+    source = sys.stdin.buffer if path == "-" else open(path, "rb")
+    try:
+        with tarfile.open(fileobj=source, mode="r|*") as archive:
+            for info in archive:
+                if info.isfile():
+                    yield info.name, info.size, archive.extractfile(info)
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+
+def write_file(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+def parse_time(value, field):
+    parsed = parse_datetime(value or "")
+    if parsed is None:
+        raise CommandError("%s: '%s' is not a valid date and time." % (field, value))
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.get_default_timezone())
+    return parsed
+
+def missing(entry, label, keys):
+    """
+    Returns an error for each of `keys` that `entry` lacks or holds a value
+    of the wrong type.
+    """
+    return ["%s: '%s' is missing or not a %s." % (label, key, kind.__name__) for key, kind in keys
+            if not isinstance(entry.get(key), kind) or isinstance(entry.get(key), bool)]
+
+class Command(BaseCommand):
+    args = "<archive>"
+    help = "Imports a contest, its problems and their test files from a zip or tar archive."
+    option_list = BaseCommand.option_list + (
+        make_option('--count', dest='count', type='int', default=settings.TESTFILES_PER_PART,
+            help="Test file pairs every part must have (default: TESTFILES_PER_PART)."),
+        make_option('--workers', dest='workers', type='int', default=8,
+            help="Threads writing test files."),
+        make_option('--prepare', action='store_true', dest='prepare', default=False,
+            help="Run prepare_contest on the imported contest."),
+    )
+
+    def progress(self, files, size, start, final=False):
+        elapsed = max(time.time() - start, 1e-6)
+        self.stdout.write("%s %d file(s), %.1f MB in %.1fs: %.0f files/s, %.1f MB/s" % (
+                "Imported" if final else "...", files, size / 1048576.0, elapsed,
+                files / elapsed, size / 1048576.0 / elapsed))
+
+    def stage(self, archive, staging, workers):
+        """
+        Streams the archive into `staging`, handing test file writes to a
+        thread pool. Returns the manifest, the other files by archive path
+        and the (kind, problem, part) -> numbers found.
+        """
+        manifest = None
+        found = defaultdict(set)
+        others = {}
+        files = size = 0
+        start = time.time()
+        pending = threading.BoundedSemaphore(workers * 4)
+
+        def release(future):
+            pending.release()
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = []
+            for name, length, f in members(archive):
+                if name.startswith("./"):
+                    name = name[2:]
+                match = TESTFILE_RE.match(name)
+                if name == MANIFEST:
+                    manifest = f.read()
+                    continue
+                if match and match.group('ext') != EXTENSIONS[match.group('kind')]:
+                    raise CommandError("%s: %s files must end in .%s." %
+                            (name, match.group('kind'), EXTENSIONS[match.group('kind')]))
+
+                if match:
+                    kind, problem = match.group('kind'), match.group('problem')
+                    found[(kind, problem, match.group('part'))].add(int(match.group('number')))
+                    target = os.path.join(staging, kind, problem, os.path.basename(name))
+                else:
+                    target = os.path.join(staging, "files", str(len(others)))
+                    others[name] = target
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+
+                if length > BUFFERED_BYTES:
+                    with open(target, "wb") as out:
+                        shutil.copyfileobj(f, out, CHUNK_SIZE)
+                else:
+                    # Bound the bytes held in memory for the pool.
+                    pending.acquire()
+                    future = pool.submit(write_file, target, f.read())
+                    future.add_done_callback(release)
+                    futures.append(future)
+
+                files += 1
+                size += length
+                if files % 10000 == 0 and int(self.verbosity) > 1:
+                    self.progress(files, size, start)
+            for future in futures:
+                future.result()
+
+        if manifest is None:
+            raise CommandError("The archive has no %s." % MANIFEST)
+        self.progress(files, size, start, final=True)
+        try:
+            return json.loads(manifest.decode("utf-8")), others, found
+        except ValueError as e:
+            raise CommandError("%s: %s" % (MANIFEST, e))
+
+    def report(self, errors):
+        for error in errors[:50]:
+            self.stderr.write(error)
+        raise CommandError("The archive failed validation with %d error(s)." % len(errors))
+
+    def check_manifest(self, manifest):
+        """
+        Returns the errors in the manifest's structure: every key create()
+        reads must be present with a value of the right type.
+        """
+        if not isinstance(manifest, dict):
+            return ["%s: expected an object." % MANIFEST]
+        errors = missing(manifest, MANIFEST, CONTEST_KEYS)
+        for key in ('begin_at', 'end_at', 'freeze_at'):
+            value = manifest.get(key)
+            if value and (not isinstance(value, str) or parse_datetime(value) is None):
+                errors.append("%s: %s '%s' is not a valid date and time." % (MANIFEST, key, value))
+        problems = manifest['problems'] if isinstance(manifest.get('problems'), list) else []
+        for number, problem in enumerate(problems, 1):
+            if not isinstance(problem, dict):
+                errors.append("Problem #%d: expected an object." % number)
+                continue
+            label = problem.get('slug') or "Problem #%d" % number
+            errors.extend(missing(problem, label, PROBLEM_KEYS))
+            if isinstance(problem.get('order'), str) and not 1 <= len(problem['order']) <= 2:
+                errors.append("%s: order '%s' must be one or two characters, like \"A\"." % (label, problem['order']))
+            parts = problem['parts'] if isinstance(problem.get('parts'), list) else []
+            for index, part in enumerate(parts, 1):
+                if isinstance(part, dict):
+                    errors.extend(missing(part, "%s/%s" % (label, part.get('name') or "#%d" % index), PART_KEYS))
+                else:
+                    errors.append("%s: part #%d is not an object." % (label, index))
+        return errors
+
+    def check_package(self, manifest, others, found, count):
+        """
+        Checks the manifest and that every part has all `count` input and
+        output files, and no others.
+        """
+        errors = self.check_manifest(manifest)
+        if errors:
+            self.report(errors)
+
+        if Contest.objects.filter(slug=manifest['slug']).exists():
+            errors.append("A contest with slug '%s' already exists." % manifest['slug'])
+
+        slugs = set()
+        for problem in manifest['problems']:
+            slug = problem['slug']
+            if not re.match(r'^[-\w]+$', slug) or slug in slugs:
+                errors.append("Problem slug '%s' is invalid or repeated." % slug)
+            slugs.add(slug)
+            # Test files live under SECRET_DIR/<kind>/<problem slug>, shared
+            # by every contest, so a slug can only be used once.
+            if Problem.objects.filter(slug=slug).exists() or any(
+                    os.path.exists(os.path.join(settings.SECRET_DIR, kind, slug)) for kind in ("inputs", "outputs")):
+                errors.append("%s: a problem or test files with this slug already exist." % slug)
+            for key in ('pdf', 'sample_input', 'sample_output'):
+                if problem[key] not in others:
+                    errors.append("%s: %s '%s' is not in the archive." % (slug, key, problem[key]))
+            for part in [problem] + problem['parts']:
+                error = part.get('checker') and checker_error(part['checker'], part.get('checker_arg', ''))
+                if error:
+                    errors.append("%s: %s" % (slug, error))
+
+            for part in problem['parts']:
+                for kind in ("inputs", "outputs"):
+                    numbers = found.pop((kind, slug, part['name']), set())
+                    absent = count - len(numbers & set(range(count)))
+                    if absent:
+                        errors.append("%s/%s: %d of %d %s missing." % (slug, part['name'], absent, count, kind))
+                    if len(numbers) > count:
+                        errors.append("%s/%s: %d extra %s." % (slug, part['name'], len(numbers) - count, kind))
+
+        for kind, slug, part in sorted(found):
+            errors.append("%s/%s/%s-*: not part of any problem in the manifest." % (slug, kind, part))
+        if errors:
+            self.report(errors)
+
+    def create(self, manifest, others):
+        """
+        Creates the contest, problems and parts in one transaction. The
+        problem files are written to storage as they are attached, so if
+        the transaction rolls back they are deleted again.
+        """
+        saved = []
+        try:
+            with transaction.atomic():
+                contest = Contest.objects.create(
+                    name=manifest['name'],
+                    slug=manifest['slug'],
+                    description=manifest.get('description', ''),
+                    begin_at=parse_time(manifest.get('begin_at'), "begin_at"),
+                    end_at=parse_time(manifest.get('end_at'), "end_at"),
+                    freeze_at=parse_time(manifest['freeze_at'], "freeze_at") if manifest.get('freeze_at') else None,
+                )
+                for problem_data in manifest['problems']:
+                    problem = Problem(
+                        contest=contest,
+                        name=problem_data['name'],
+                        slug=problem_data['slug'],
+                        order=problem_data['order'],
+                        time_limit=problem_data['time_limit'],
+                        checker=problem_data.get('checker') or "token",
+                        checker_arg=problem_data.get('checker_arg', ''),
+                    )
+                    for field, key, filename in (('pdf', 'pdf', "problem.pdf"),
+                            ('sampleinput', 'sample_input', "sample.in"),
+                            ('sampleoutput', 'sample_output', "sample.out")):
+                        with open(others[problem_data[key]], "rb") as f:
+                            getattr(problem, field).save(filename, File(f), save=False)
+                        saved.append(getattr(problem, field))
+                    problem.save()
+                    for order, part in enumerate(problem_data['parts']):
+                        ProblemPart.objects.create(problem=problem, name=part['name'], points=part['points'],
+                                order=part.get('order', order), checker=part.get('checker', ''),
+                                checker_arg=part.get('checker_arg', ''))
+        except BaseException:
+            for fieldfile in saved:
+                fieldfile.storage.delete(fieldfile.name)
+            raise
+        return contest
+
+    def install(self, staging, slugs):
+        """
+        Moves each problem's staged test files into SECRET_DIR with one
+        rename per directory. check_package() made sure none of them
+        exists yet; one that appeared since is left alone.
+        """
+        for kind in ("inputs", "outputs"):
+            for slug in slugs:
+                staged = os.path.join(staging, kind, slug)
+                if not os.path.isdir(staged):
+                    continue
+                target = os.path.join(settings.SECRET_DIR, kind, slug)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                if os.path.exists(target):
+                    raise CommandError("%s appeared during the import; its test files were not installed." % target)
+                os.rename(staged, target)
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage: manage.py import_contest <archive>")
+        self.verbosity = options.get('verbosity', 1)
+
+        # Stage next to SECRET_DIR so that installing is a rename.
+        os.makedirs(settings.SECRET_DIR, exist_ok=True)
+        staging = os.path.join(settings.SECRET_DIR, ".import-%s" % uuid.uuid4().hex)
+        try:
+            manifest, others, found = self.stage(args[0], staging, options['workers'])
+            self.check_package(manifest, others, found, options['count'])
+            contest = self.create(manifest, others)
+            self.install(staging, [problem['slug'] for problem in manifest['problems']])
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        self.stdout.write("Created contest '%s' with %d problem(s)." % (contest.slug, len(manifest['problems'])))
+        if options['prepare']:
+            call_command('prepare_contest', contest.slug, count=options['count'])
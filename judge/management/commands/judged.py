@@ -0,0 +1,74 @@
+from optparse import make_option
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from judge import settings
+from judge.judging import claim, process, metrics
+from judge.oracles import oracle_store
+
+logger = logging.getLogger(__name__)
+
+def work(name, poll):
+    # Never share the parent's database connection with a forked child.
+    connection.close()
+    done = 0
+    while True:
+        task = claim(name)
+        if task is None:
+            time.sleep(poll)
+            continue
+        process(task)
+        done += 1
+        if done % 100 == 0:
+            logger.info("%s: %d task(s) done, oracle cache %s", name, done, oracle_store.stats())
+
+class Command(BaseCommand):
+    help = "Runs a pool of judging worker processes that score queued attempts."
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', dest='workers', type='int', default=multiprocessing.cpu_count(),
+            help="Number of worker processes (default: one per CPU)."),
+        make_option('--poll', dest='poll', type='float', default=0.5,
+            help="Seconds an idle worker waits before polling the queue again."),
+        make_option('--stats', action='store_true', dest='stats', default=False,
+            help="Print queue depth and per-verdict latency, then exit."),
+        make_option('--no-index', action='store_false', dest='index', default=True,
+            help="Don't hash the oracle files before starting the workers."),
+    )
+
+    def spawn(self, index, poll):
+        name = "%s:%d:%d" % (socket.gethostname(), os.getpid(), index)
+        worker = multiprocessing.Process(target=work, args=(name, poll), name=name)
+        worker.daemon = True
+        worker.start()
+        return worker
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(json.dumps(metrics(), indent=2))
+            return
+
+        if options['index']:
+            # Hash once in the parent; the forked workers inherit the index.
+            count = oracle_store.index(os.path.join(settings.SECRET_DIR, "outputs"))
+            self.stdout.write("Indexed %d oracle file(s)." % count)
+
+        connection.close()
+        poll = options['poll']
+        workers = [self.spawn(i, poll) for i in range(options['workers'])]
+        self.stdout.write("Started %d judging worker(s)." % len(workers))
+
+        try:
+            while True:
+                time.sleep(1)
+                for i, worker in enumerate(workers):
+                    if not worker.is_alive():
+                        self.stderr.write("Worker %s exited with %s, restarting." % (worker.name, worker.exitcode))
+                        workers[i] = self.spawn(i, poll)
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
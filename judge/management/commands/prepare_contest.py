@@ -0,0 +1,111 @@
+from optparse import make_option
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import hashlib
+import os
+import shutil
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from judge import settings
+from judge.models import Contest, ProblemPart, TestFile, get_testfile_path, get_bundle_path
+from judge.checkers import CHUNK_SIZE
+
+def warm(path):
+    """
+    Asks the kernel to pull a file into the page cache.
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    finally:
+        os.close(fd)
+
+def compress(path):
+    bundle = get_bundle_path(path)
+    os.makedirs(os.path.dirname(bundle), exist_ok=True)
+    staging = bundle + ".tmp"
+    with open(path, "rb") as src, gzip.open(staging, "wb") as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    os.rename(staging, bundle)
+    return bundle
+
+def prepare(job):
+    """
+    Hashes one test file (which also pulls it into the page cache) and, for
+    inputs, writes its gzip copy. Returns None when the file is missing.
+    """
+    part_id, kind, number, path, options = job
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        chunk = f.read(CHUNK_SIZE)
+        while chunk:
+            sha.update(chunk)
+            chunk = f.read(CHUNK_SIZE)
+
+    compressed_size = None
+    if kind == "inputs" and options['compress']:
+        bundle = get_bundle_path(path)
+        try:
+            fresh = os.stat(bundle).st_mtime >= stat.st_mtime
+        except OSError:
+            fresh = False
+        if not fresh:
+            compress(path)
+        compressed_size = os.stat(bundle).st_size
+        if options['warm']:
+            warm(bundle)
+
+    return TestFile(part_id=part_id, kind=kind, number=number, size=stat.st_size,
+            mtime=stat.st_mtime, sha1=sha.hexdigest(), compressed_size=compressed_size)
+
+class Command(BaseCommand):
+    args = "<contest slug>"
+    help = "Validates, indexes, compresses and pre-warms every test file a contest can hand out."
+    option_list = BaseCommand.option_list + (
+        make_option('--count', dest='count', type='int', default=settings.TESTFILES_PER_PART,
+            help="Number of test files per part (default: TESTFILES_PER_PART)."),
+        make_option('--workers', dest='workers', type='int', default=8),
+        make_option('--no-compress', action='store_false', dest='compress', default=True,
+            help="Don't write gzip copies of the inputs."),
+        make_option('--no-warm', action='store_false', dest='warm', default=True,
+            help="Don't ask the kernel to cache the compressed copies."),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage: manage.py prepare_contest <contest slug>")
+        try:
+            contest = Contest.objects.get(slug=args[0])
+        except Contest.DoesNotExist:
+            raise CommandError("No contest with slug '%s'." % args[0])
+
+        parts = ProblemPart.objects.filter(problem__contest=contest).select_related('problem')
+        jobs = [(part.id, kind, number, get_testfile_path(kind, part.problem.slug, part.name, number), options)
+                for part in parts for kind in ("inputs", "outputs") for number in range(options['count'])]
+
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            results = list(pool.map(prepare, jobs))
+        elapsed = time.time() - start
+
+        found = [entry for entry in results if entry is not None]
+        missing = [job[3] for job, entry in zip(jobs, results) if entry is None]
+
+        with transaction.atomic():
+            TestFile.objects.filter(part__in=parts).delete()
+            TestFile.objects.bulk_create(found)
+
+        total = sum(entry.size for entry in found)
+        self.stdout.write("Indexed %d file(s), %.1f MB, in %.1fs." % (len(found), total / 1048576.0, elapsed))
+        for path in missing[:20]:
+            self.stderr.write("Missing: %s" % path)
+        if missing:
+            raise CommandError("%d test file(s) are missing." % len(missing))
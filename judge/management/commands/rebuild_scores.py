@@ -0,0 +1,71 @@
+from optparse import make_option
+from itertools import groupby
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from judge.models import Attempt, BestScore, Contest
+from judge.scoreboard import bump_version
+
+class Command(BaseCommand):
+    help = "Rebuilds the BestScore table from the Attempt history and verifies it."
+    option_list = BaseCommand.option_list + (
+        make_option('--verify', action='store_true', dest='verify', default=False,
+            help="Only compare the stored table with the Attempt history."),
+        make_option('--contest', dest='contest', default=None,
+            help="Restrict to the contest with this slug."),
+    )
+
+    def expected(self, contest):
+        attempts = Attempt.objects.order_by('owner', 'part')
+        if contest:
+            attempts = attempts.filter(part__problem__contest__slug=contest)
+        rows = attempts.values_list('owner', 'part', 'score', 'status', 'reason', 'created_at').iterator()
+
+        result = {}
+        for key, group in groupby(rows, key=lambda row: row[:2]):
+            result[key] = BestScore.tally(row[2:] for row in group)
+        return result
+
+    def stored(self, contest):
+        rows = BestScore.objects.all()
+        if contest:
+            rows = rows.filter(part__problem__contest__slug=contest)
+        return dict((row[:2], row[2:]) for row in rows.values_list('user', 'part', *BestScore.FIELDS))
+
+    def handle(self, *args, **options):
+        contest = options['contest']
+        expected = self.expected(contest)
+
+        if options['verify']:
+            stored = self.stored(contest)
+            # Rows are only created when an attempt is scored, so a team
+            # whose attempts all timed out or are pending has none; a
+            # missing row stands for the empty tally.
+            empty = BestScore.tally([])
+            mismatches = 0
+            for key in sorted(set(expected) | set(stored)):
+                if expected.get(key, empty) != stored.get(key, empty):
+                    mismatches += 1
+                    self.stdout.write("user %d, part %d: stored %r, expected %r" %
+                            (key[0], key[1], stored.get(key), expected.get(key)))
+            if mismatches:
+                raise CommandError("%d BestScore row(s) do not match the Attempt history." % mismatches)
+            self.stdout.write("%d BestScore row(s) verified." % len(expected))
+            return
+
+        with transaction.atomic():
+            existing = BestScore.objects.all()
+            if contest:
+                existing = existing.filter(part__problem__contest__slug=contest)
+            existing.delete()
+            BestScore.objects.bulk_create([
+                BestScore(user_id=user, part_id=part, **dict(zip(BestScore.FIELDS, tally)))
+                for (user, part), tally in expected.items()
+            ])
+        contests = Contest.objects.all()
+        if contest:
+            contests = contests.filter(slug=contest)
+        for contest_id in contests.values_list('id', flat=True):
+            bump_version(contest_id)
+            bump_version(contest_id, "frozen")
+            bump_version(contest_id, "ranking")
+        self.stdout.write("Rebuilt %d BestScore row(s)." % len(expected))
@@ -0,0 +1,151 @@
+from optparse import make_option
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import time
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from judge.models import Attempt, BestScore, Contest, ProblemPart, get_testfile_path
+from judge.checkers import load_checker
+from judge.util import check_files, verdict
+from judge.scoreboard import bump_version
+from judge.events import publish, verdict_event, standing_event
+from judge import history
+
+def rejudge_one(job):
+    """
+    Rescores one attempt. Any error (a missing file, undecodable output, a
+    broken custom checker) is returned rather than raised, so one bad
+    attempt doesn't stop the batch.
+    """
+    pk, answer_path, oracle_path, checker, points = job
+    try:
+        reason = check_files(answer_path, oracle_path, load_checker(checker))
+    except (IOError, OSError) as e:
+        return pk, None, str(e)
+    except Exception as e:
+        return pk, None, "%s: %s" % (e.__class__.__name__, e)
+    status, score = verdict(reason, points)
+    return pk, (status, reason, score), None
+
+class Command(BaseCommand):
+    help = "Rescores submitted attempts in parallel and writes back the verdicts that changed."
+    option_list = BaseCommand.option_list + (
+        make_option('--contest', dest='contest', default=None, help="Contest slug."),
+        make_option('--problem', dest='problem', default=None, help="Problem slug."),
+        make_option('--part', dest='part', default=None, help="Part name."),
+        make_option('--since', dest='since', default=None,
+            help="Only attempts created at or after this date/time (YYYY-MM-DD[ HH:MM[:SS]])."),
+        make_option('--include-manual', action='store_true', dest='manual', default=False,
+            help="Also rescore attempts that were scored manually."),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+            help="Only show the verdicts that would change."),
+        make_option('--workers', dest='workers', type='int', default=multiprocessing.cpu_count()),
+        make_option('--batch', dest='batch', type='int', default=500,
+            help="Number of changed attempts written per transaction."),
+    )
+
+    def select(self, options):
+        attempts = Attempt.objects.exclude(outputfile='').exclude(outputfile__isnull=True)
+        if options['contest']:
+            attempts = attempts.filter(part__problem__contest__slug=options['contest'])
+        if options['problem']:
+            attempts = attempts.filter(part__problem__slug=options['problem'])
+        if options['part']:
+            attempts = attempts.filter(part__name=options['part'])
+        if options['since']:
+            since = parse_datetime(options['since']) or parse_datetime(options['since'] + " 00:00")
+            if since is None:
+                raise CommandError("Could not parse --since '%s'." % options['since'])
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since, timezone.get_current_timezone())
+            attempts = attempts.filter(created_at__gte=since)
+        if not options['manual']:
+            attempts = attempts.exclude(reason=Attempt.SCORED_MANUALLY)
+        return attempts.order_by('pk')
+
+    def write(self, changes, batch):
+        """
+        Writes changed verdicts with one UPDATE per distinct verdict and
+        batch, then refreshes the best scores of the affected users.
+        """
+        grouped = defaultdict(list)
+        for pk, result in changes:
+            grouped[result].append(pk)
+
+        for (status, reason, score), pks in grouped.items():
+            for i in range(0, len(pks), batch):
+                with transaction.atomic():
+                    Attempt.objects.filter(pk__in=pks[i:i + batch]) \
+                            .update(status=status, reason=reason, score=score)
+
+        changed = list(Attempt.objects.filter(pk__in=[pk for pk, result in changes]).select_related('part__problem'))
+        # Each pair's log is rewritten from its earliest rescored attempt on.
+        stamps = {}
+        for attempt in changed:
+            key = (attempt.owner_id, attempt.part_id)
+            stamps[key] = min(stamps.get(key, attempt.created_at), attempt.created_at)
+        parts = dict((attempt.part_id, attempt.part.problem.contest_id) for attempt in changed)
+        pairs = set(stamps)
+        for user_id, part_id in pairs:
+            BestScore.refresh(user_id, part_id)
+            # Rescoring can move a solve or a failure in time without
+            # changing the final tally, so the log is rewritten regardless.
+            history.record(parts[part_id], user_id, part_id, stamps[(user_id, part_id)])
+
+        contests = Contest.objects.in_bulk(set(parts.values()))
+        for contest_id in contests:
+            bump_version(contest_id)
+            bump_version(contest_id, "frozen")
+
+        publish(*[verdict_event(attempt) for attempt in changed])
+        publish(*[standing_event(contests[contest_id], user_id) for contest_id, user_id in
+                set((parts[part_id], user_id) for user_id, part_id in pairs) if not contests[contest_id].is_frozen()])
+        return pairs
+
+    def handle(self, *args, **options):
+        attempts = self.select(options)
+        parts = dict((part.id, part) for part in ProblemPart.objects.select_related('problem'))
+        reasons = dict(Attempt.CHOICES_REASON)
+        statuses = dict(Attempt.CHOICES_STATUS)
+
+        jobs = []
+        current = {}
+        for pk, outputfile, testfileid, part_id, status, reason, score in attempts.values_list(
+                'pk', 'outputfile', 'testfileid', 'part', 'status', 'reason', 'score'):
+            part = parts[part_id]
+            oracle = get_testfile_path("outputs", part.problem.slug, part.name, testfileid)
+            jobs.append((pk, default_storage.path(outputfile), oracle, part.get_checker(), part.points))
+            current[pk] = (status, reason, score)
+
+        self.stdout.write("Rejudging %d attempt(s) with %d worker(s)..." % (len(jobs), options['workers']))
+        start = time.time()
+        changes = []
+        errors = 0
+        # Workers only read files; don't let forked children share the
+        # parent's database connection.
+        connection.close()
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            for pk, result, error in pool.map(rejudge_one, jobs, chunksize=64):
+                if error:
+                    errors += 1
+                    self.stderr.write("Attempt #%d: %s" % (pk, error))
+                elif result != current[pk]:
+                    changes.append((pk, result))
+        elapsed = time.time() - start
+
+        for pk, (status, reason, score) in changes:
+            old_status, old_reason, old_score = current[pk]
+            self.stdout.write("#%d: %s/%s (%d) -> %s/%s (%d)" % (pk,
+                    statuses.get(old_status), reasons.get(old_reason), old_score,
+                    statuses.get(status), reasons.get(reason), score))
+
+        if not options['dry_run'] and changes:
+            self.write(changes, options['batch'])
+
+        rate = len(jobs) / elapsed if elapsed else 0
+        self.stdout.write("%d attempt(s) checked in %.1fs (%.1f attempts/sec), %d changed%s, %d error(s)." % (
+                len(jobs), elapsed, rate, len(changes), " (dry run)" if options['dry_run'] else "", errors))
@@ -0,0 +1,111 @@
+from optparse import make_option
+import re
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.core.management.sql import custom_sql_for_model
+from django.db import connection, transaction, DatabaseError
+from django.db.models import get_app, get_models
+from django.utils import timezone
+
+INDEX_RE = re.compile(r'^CREATE\s+(?:UNIQUE\s+)?INDEX\s+[`"]?(\w+)', re.IGNORECASE)
+
+# What to run once columns were added to a model's table, so that the
+# existing rows get real values rather than the column defaults.
+FOLLOW_UP = {
+    'Attempt': "manage.py expire_attempts gives pending attempts their deadline.",
+    'BestScore': "manage.py rebuild_scores fills in the new BestScore columns.",
+}
+
+def quote_value(value):
+    if isinstance(value, bool):
+        return "'%d'" % value
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'%s'" % str(value).replace("'", "''")
+
+def column_definition(field):
+    """
+    The column of `field` for ALTER TABLE ... ADD COLUMN. A NOT NULL
+    column gets the field's default for the existing rows; auto_now and
+    auto_now_add columns get the current time.
+    """
+    definition = "%s %s" % (connection.ops.quote_name(field.column), field.db_type(connection))
+    if field.null:
+        return definition + " NULL"
+    default = field.get_default()
+    if default is None and (getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)):
+        default = timezone.now()
+    if default is None:
+        raise CommandError("%s.%s has no default to give existing rows." % (field.model.__name__, field.name))
+    return "%s NOT NULL DEFAULT %s" % (definition, quote_value(field.get_db_prep_save(default, connection)))
+
+def index_names(cursor):
+    queries = {
+        'sqlite': "SELECT name FROM sqlite_master WHERE type = 'index'",
+        'postgresql': "SELECT indexname FROM pg_indexes",
+        'mysql': "SELECT index_name FROM information_schema.statistics WHERE table_schema = DATABASE()",
+    }
+    if connection.vendor not in queries:
+        raise CommandError("Don't know how to list the indexes of a %s database." % connection.vendor)
+    cursor.execute(queries[connection.vendor])
+    return set(row[0] for row in cursor.fetchall())
+
+class Command(BaseCommand):
+    help = "Adds the columns and indexes the judge models declare that an existing database is missing."
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+            help="Only print the statements."),
+    )
+
+    def columns(self, cursor):
+        """
+        syncdb creates missing tables but never alters existing ones, so
+        databases created before a field was added to a model lack its
+        column. Yields (model, statement) for each of them.
+        """
+        tables = connection.introspection.table_names(cursor)
+        for model in get_models(get_app('judge')):
+            table = model._meta.db_table
+            if table not in tables:
+                raise CommandError("There is no %s table; run manage.py syncdb first." % table)
+            existing = set(column[0] for column in connection.introspection.get_table_description(cursor, table))
+            for field in model._meta.local_fields:
+                if field.column not in existing:
+                    yield model, "ALTER TABLE %s ADD COLUMN %s" % (
+                            connection.ops.quote_name(table), column_definition(field))
+
+    def indexes(self, cursor):
+        """
+        Likewise syncdb only creates indexes along with their table. Yields
+        the CREATE INDEX statements of the indexes that don't exist yet.
+        """
+        style = no_style()
+        existing = index_names(cursor)
+        for model in get_models(get_app('judge')):
+            statements = connection.creation.sql_indexes_for_model(model, style) + \
+                    [statement for statement in custom_sql_for_model(model, style, connection)
+                    if statement.upper().startswith("CREATE INDEX")]
+            for statement in statements:
+                match = INDEX_RE.match(statement)
+                if not match or match.group(1) not in existing:
+                    yield statement
+
+    def handle(self, *args, **options):
+        cursor = connection.cursor()
+        columns = list(self.columns(cursor))
+        indexes = list(self.indexes(cursor))
+        for statement in [statement for model, statement in columns] + indexes:
+            self.stdout.write(statement)
+            if options['dry_run']:
+                continue
+            try:
+                with transaction.atomic():
+                    cursor.execute(statement)
+            except DatabaseError as e:
+                raise CommandError("%s failed: %s" % (statement, e))
+
+        if not options['dry_run']:
+            self.stdout.write("Added %d column(s) and %d index(es)." % (len(columns), len(indexes)))
+        for name in sorted(set(model.__name__ for model, statement in columns)):
+            if name in FOLLOW_UP:
+                self.stdout.write("Then run: " + FOLLOW_UP[name])
@@ -0,0 +1,40 @@
+from optparse import make_option
+import json
+from django.core.management.base import BaseCommand
+from judge import instrument
+
+class Command(BaseCommand):
+    help = "Prints latency, query and render percentiles per view from the instrumentation dumps."
+    option_list = BaseCommand.option_list + (
+        make_option('--max-age', dest='max_age', type='int', default=3600,
+            help="Ignore dumps older than this many seconds (0 for all)."),
+        make_option('--json', action='store_true', dest='json', default=False,
+            help="Print the raw summary as JSON."),
+        make_option('--profile', dest='profile', default=None,
+            help="Print the captured cProfile stats of one view instead."),
+    )
+
+    def handle(self, *args, **options):
+        samples, profiles = instrument.load(max_age=options['max_age'])
+        if options['profile']:
+            entries = profiles.get(options['profile'], [])
+            if not entries:
+                self.stdout.write("No profiles captured for %s." % options['profile'])
+            for entry in entries:
+                self.stdout.write("%s (%.3fs)\n%s" % (entry['path'], entry['latency'], entry['stats']))
+            return
+
+        summary = instrument.summarize(samples)
+        if options['json']:
+            self.stdout.write(json.dumps(summary, indent=2))
+            return
+        if not summary:
+            self.stdout.write("No samples; is JUDGE_INSTRUMENT on?")
+            return
+
+        self.stdout.write("%-28s %7s %9s %9s %9s %8s %9s %9s" %
+                ("view", "count", "p50 ms", "p90 ms", "p99 ms", "queries", "sql ms", "render ms"))
+        for name, entry in summary.items():
+            self.stdout.write("%-28s %7d %9.1f %9.1f %9.1f %8.1f %9.1f %9.1f" % (name, entry['count'],
+                    entry['latency']['p50'] * 1000, entry['latency']['p90'] * 1000, entry['latency']['p99'] * 1000,
+                    entry['queries']['p90'], entry['sql']['p90'] * 1000, entry['render']['p90'] * 1000))
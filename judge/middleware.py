@@ -1,12 +1,33 @@
-from judge.models import Attempt
+from django.core.exceptions import MiddlewareNotUsed
+from judge import context, instrument, settings
 
-class CheckAttempts:
+class RequestContext:
     def process_request(self, request):
-        if request.user.is_authenticated():
-            attempts = Attempt.objects.filter(status=Attempt.IN_PROGRESS).all()
-            for attempt in attempts:
-                if attempt.time_passed() >= attempt.part.problem.time_limit:
-                    attempt.status = Attempt.INCORRECT
-                    attempt.reason = Attempt.TIMEOUT
-                    attempt.save()
+        context.begin(request)
         return None
+
+    def process_response(self, request, response):
+        context.end()
+        return response
+
+    def process_exception(self, request, exception):
+        context.end()
+        return None
+
+class Instrument:
+    """
+    Records per-view timings and query counts when JUDGE_INSTRUMENT is on.
+    Listed first so that it also times the other middleware.
+    """
+    def __init__(self):
+        if not settings.JUDGE_INSTRUMENT:
+            raise MiddlewareNotUsed
+        instrument.install()
+
+    def process_request(self, request):
+        instrument.begin()
+        return None
+
+    def process_response(self, request, response):
+        instrument.finish(request)
+        return response
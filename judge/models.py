@@ -1,9 +1,11 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
-from judge import settings
+from judge import settings, context, db
 from functools import partial
-from datetime import datetime
+from django.utils import timezone
+from datetime import timedelta
 import os
 import random
 import string
@@ -25,11 +27,38 @@ def get_upload_path(ft, instance, filename):
             "%d-%s" % (contest.id, contest.slug), instance.owner.username,
             "%s_%s-%d%s" % (problem.slug, part.name, instance.testfileid, ext))
 
+def get_testfile_path(kind, problem_slug, part_name, number):
+    ext = ".in" if kind == "inputs" else ".out"
+    return os.path.join(settings.SECRET_DIR, kind, problem_slug,
+            "%s-%d%s" % (part_name, number, ext))
+
+def get_bundle_path(path):
+    """
+    Where the gzip-compressed copy of a test file lives.
+    """
+    return os.path.join(settings.BUNDLE_DIR, os.path.relpath(path, settings.SECRET_DIR) + ".gz")
+
+def clean_checker(name, arg):
+    # judge.checkers imports this module.
+    from judge.checkers import checker_error
+    error = checker_error(name, arg)
+    if error:
+        raise ValidationError({'checker_arg': [error]})
+
 def get_problem_directory(instance, filename):
     contest = instance.contest
     return os.path.join(settings.SUBMISSION_DIR,
             "%d-%s" % (contest.id, contest.slug), instance.slug, filename)
 
+CHECKER_CHOICES = (
+    ("token", "Whitespace-separated tokens"),
+    ("exact", "Exact lines"),
+    ("nocase", "Case-insensitive tokens"),
+    ("float", "Numbers within a tolerance"),
+    ("unordered", "Lines in any order"),
+    ("custom", "Custom Python checker"),
+)
+
 class Contest(models.Model):
     name = models.CharField(max_length=256)
     slug = models.SlugField()
@@ -37,9 +66,13 @@ class Contest(models.Model):
     end_at = models.DateTimeField()
     contestants = models.ManyToManyField(User, related_name="contests", blank=True)
     description = models.TextField()
+    freeze_at = models.DateTimeField(null=True, blank=True,
+            help_text="From this time on the public scoreboard only counts earlier submissions.")
+    unfreeze_at = models.DateTimeField(null=True, blank=True,
+            help_text="When to reveal the final scoreboard; leave empty to keep it frozen.")
 
     def get_active(self):
-        now = datetime.now(self.begin_at.tzinfo)
+        now = context.now()
         if self.end_at < now:
             return "Ended"
         elif self.begin_at < now:
@@ -48,24 +81,26 @@ class Contest(models.Model):
             return "Not Started"
     
     def has_begun(self):
-        now = datetime.now(self.begin_at.tzinfo)
-        return self.begin_at < now
+        return self.begin_at < context.now()
 
     def has_ended(self):
-        now = datetime.now(self.begin_at.tzinfo)
-        return self.end_at < now
+        return self.end_at < context.now()
     
     def is_ongoing(self):
-        now = datetime.now(self.begin_at.tzinfo)
+        now = context.now()
         return self.begin_at < now and self.end_at > now
 
+    def is_frozen(self):
+        now = context.now()
+        return self.freeze_at is not None and self.freeze_at <= now \
+                and (self.unfreeze_at is None or now < self.unfreeze_at)
+
     def has_contestant(self, user):
-        if not user.is_authenticated():
-            return False
-        return self.contestants.filter(id=user.id).exists()
+        return context.is_contestant(self, user)
 
     def get_score(self, user):
-        return sum([problem.get_score(user) for problem in self.problems.all()], 0)
+        return BestScore.objects.filter(user=user, part__problem__contest=self) \
+                .aggregate(total=models.Sum("score"))['total'] or 0
 
     def __str__(self):
         return "%s (%s)" % (self.name, self.get_active())
@@ -79,6 +114,9 @@ class Problem(models.Model):
     pdf = models.FileField(upload_to=get_problem_directory)
     sampleinput = models.FileField("Sample Input", upload_to=get_problem_directory)
     sampleoutput = models.FileField("Sample Output", upload_to=get_problem_directory)
+    checker = models.CharField(max_length=32, choices=CHECKER_CHOICES, default="token")
+    checker_arg = models.CharField("Checker argument", max_length=256, blank=True,
+            help_text="Tolerance for the float checker, dotted path of the function for a custom checker.")
 
     class Meta:
         ordering = ['order']
@@ -92,6 +130,9 @@ class Problem(models.Model):
     def __str__(self):
         return "%s. %s" % (self.order, self.name)
 
+    def clean(self):
+        clean_checker(self.checker, self.checker_arg)
+
     def pdf_relative(self):
         return reverse('problem_pdf', kwargs={
                 'contest': self.contest.slug,
@@ -102,11 +143,14 @@ class Problem(models.Model):
         return self.parts.aggregate(total=models.Sum("points"))['total'] or 0
 
     def get_score(self, user):
-        return sum([part.get_score(user) for part in self.parts.all()], 0)
+        return BestScore.objects.filter(user=user, part__problem=self) \
+                .aggregate(total=models.Sum("score"))['total'] or 0
 
     def get_next_part(self, user):
+        scores = dict(BestScore.objects.filter(user=user, part__problem=self) \
+                .values_list('part', 'score'))
         for part in self.parts.all():
-            if part.get_score(user) != part.points:
+            if scores.get(part.id, 0) != part.points:
                 return part
         return None
 
@@ -115,14 +159,39 @@ class ProblemPart(models.Model):
     name = models.CharField(max_length=64)
     points = models.IntegerField()
     order = models.IntegerField()
+    checker = models.CharField(max_length=32, choices=CHECKER_CHOICES, blank=True,
+            help_text="Leave blank to use the problem's checker.")
+    checker_arg = models.CharField("Checker argument", max_length=256, blank=True)
+    next_testfile = models.IntegerField(default=0, editable=False)
 
     class Meta:
         ordering = ['order']
 
+    def take_testfile(self):
+        """
+        Hands out the next test file number for this part. The counter is
+        bumped with an F() expression and read back inside the transaction
+        that holds the row's write lock, so concurrent attempts never get the
+        same number and files are used round-robin.
+        """
+        with transaction.atomic():
+            parts = ProblemPart.objects.filter(pk=self.pk)
+            parts.update(next_testfile=models.F('next_testfile') + 1)
+            taken = parts.values_list('next_testfile', flat=True).get()
+        return (taken - 1) % settings.TESTFILES_PER_PART
+
+    def clean(self):
+        if self.checker:
+            clean_checker(self.checker, self.checker_arg)
+
+    def get_checker(self):
+        if self.checker:
+            return (self.checker, self.checker_arg)
+        return (self.problem.checker, self.problem.checker_arg)
+
     def get_score(self, user):
-        if self.attempts.filter(owner=user).count() == 0:
-            return 0
-        return self.attempts.filter(owner=user).aggregate(maxscore=models.Max("score"))['maxscore']
+        best = self.best_scores.filter(user=user).values_list('score', flat=True).first()
+        return best or 0
 
 class Attempt(models.Model):
     IN_PROGRESS = 1
@@ -140,6 +209,7 @@ class Attempt(models.Model):
     TIMEOUT = 3
     BAD_SUBMISSION = 4
     SCORED_MANUALLY = 5
+    JUDGE_ERROR = 6
 
     CHOICES_REASON = (
         (ACCEPTED, "Accepted"),
@@ -147,11 +217,12 @@ class Attempt(models.Model):
         (TIMEOUT, "Time Limit Exceeded"),
         (BAD_SUBMISSION, "Bad Submission"),
         (SCORED_MANUALLY, "Scored Manually"),
+        (JUDGE_ERROR, "Judging Failed"),
     )
 
     owner = models.ForeignKey(User, related_name="attempts")
     part = models.ForeignKey(ProblemPart, related_name="attempts")
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     status = models.IntegerField(choices=CHOICES_STATUS, default=1)
     score = models.IntegerField(default=0)
     reason = models.IntegerField(choices=CHOICES_REASON, default=1, null=True)
@@ -159,36 +230,178 @@ class Attempt(models.Model):
     outputfile = models.FileField("Ouptut File", upload_to=partial(get_upload_path, 'out'), null=True, blank=True)
     sourcefile = models.FileField("Source File", upload_to=partial(get_upload_path, 'src'), null=True, blank=True)
     randomness = models.CharField(max_length=16, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ['-created_at']
+        # Partial indexes on pending attempts live in sql/attempt.*.sql.
+        index_together = (
+            ('owner', 'part', 'created_at'),
+            ('part', 'status', 'created_at'),
+            ('part', 'created_at'),
+            ('status', 'expires_at'),
+            ('status', 'created_at'),
+        )
 
     def save(self):
+        if self.expires_at is None and self.pk is None:
+            self.expires_at = timezone.now() + timedelta(seconds=self.part.problem.time_limit)
         if self.testfileid is None:
-            self.testfileid = Attempt.objects.filter(part=self.part).count() % 5000
+            self.testfileid = self.part.take_testfile()
         if not self.randomness:
             self.randomness = "".join(random.choice(string.ascii_letters+string.digits) for i in range(16))
         return super().save()
 
     def time_passed(self):
-        return min(int((datetime.now(self.created_at.tzinfo) - self.created_at).total_seconds()), self.part.problem.time_limit)
+        return min(int((context.now() - self.created_at).total_seconds()), self.part.problem.time_limit)
 
     def get_inputfile_path(self):
-        return os.path.join(settings.SECRET_DIR, "inputs",
-                self.part.problem.slug, "%s-%d.in" % (self.part.name, self.testfileid))
+        return get_testfile_path("inputs", self.part.problem.slug, self.part.name, self.testfileid)
 
     def get_outputfile_path(self):
-        return os.path.join(settings.SECRET_DIR, "outputs",
-                self.part.problem.slug, "%s-%d.out" % (self.part.name, self.testfileid))
+        return get_testfile_path("outputs", self.part.problem.slug, self.part.name, self.testfileid)
+
+    def has_expired(self):
+        if self.outputfile or self.expires_at is None:
+            return False
+        return self.expires_at <= context.now()
+
+    def accepts_upload(self):
+        """
+        Whether output can still be uploaded: the attempt is pending,
+        nothing was uploaded yet and its deadline hasn't passed.
+        """
+        return self.status == self.IN_PROGRESS and not self.outputfile and \
+                (self.expires_at is None or context.now() < self.expires_at)
 
     def is_in_progress(self):
-        return self.status == 1
+        return self.status == 1 and not self.has_expired()
 
     def is_accepted(self):
         return self.status == 2
 
     def is_rejected(self):
-        return self.status == 3
+        return self.status == 3 or (self.status == 1 and self.has_expired())
+
+class JudgeTask(models.Model):
+    """
+    An uploaded attempt waiting in the judging queue. Workers lease tasks
+    and mark them finished once the attempt has been scored; a task whose
+    lease runs out is handed to another worker.
+    """
+    attempt = models.ForeignKey(Attempt, related_name="tasks")
+    enqueued_at = models.DateTimeField(auto_now_add=True)
+    leased_until = models.DateTimeField(null=True, blank=True)
+    leased_by = models.CharField(max_length=64, blank=True)
+    tries = models.IntegerField(default=0)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    reason = models.IntegerField(choices=Attempt.CHOICES_REASON, null=True, blank=True)
+
+    class Meta:
+        ordering = ['enqueued_at']
+        index_together = (('finished_at', 'enqueued_at'),)
+
+    def __str__(self):
+        return "Task #%d for attempt #%d" % (self.id, self.attempt_id)
+
+class TestFile(models.Model):
+    """
+    Index entry for a test file, written by `manage.py prepare_contest` so
+    that downloads need neither a filesystem probe nor a hash.
+    """
+    CHOICES_KIND = (
+        ("inputs", "Input"),
+        ("outputs", "Output"),
+    )
+
+    part = models.ForeignKey(ProblemPart, related_name="testfiles")
+    kind = models.CharField(max_length=8, choices=CHOICES_KIND)
+    number = models.IntegerField()
+    size = models.BigIntegerField()
+    mtime = models.FloatField()
+    sha1 = models.CharField(max_length=40)
+    compressed_size = models.BigIntegerField(null=True, blank=True)
+
+    class Meta:
+        unique_together = (('part', 'kind', 'number'),)
+
+    def __str__(self):
+        return "%s-%d (%s)" % (self.part.name, self.number, self.kind)
+
+class BestScore(models.Model):
+    """
+    Denormalized best result of a user on a problem part. Kept up to date
+    by judge.util.save_result so that score lookups never have to
+    aggregate over the full Attempt history.
+    """
+    user = models.ForeignKey(User, related_name="best_scores")
+    part = models.ForeignKey(ProblemPart, related_name="best_scores")
+    score = models.IntegerField(default=0)
+    solved_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    failures = models.IntegerField(default=0)
+    improved_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    FIELDS = ('score', 'solved_at', 'attempts', 'failures', 'improved_at')
+
+    class Meta:
+        unique_together = (('user', 'part'),)
+
+    @staticmethod
+    def tally(rows):
+        """
+        Folds (score, status, reason, created_at) rows of one user's attempts
+        on one part into a (score, solved_at, attempts, failures,
+        improved_at) tuple. Attempts that were never submitted (pending or
+        timed out) are not counted. Failures are the rejected submissions,
+        badly formatted ones included, before the first correct one, not
+        counting those the judge itself failed on, and improved_at is when
+        the best score was first reached.
+        """
+        rows = list(rows)
+        best, solved_at, attempts = 0, None, 0
+        for score, status, reason, created_at in rows:
+            best = max(best, score)
+            if status == Attempt.CORRECT and (solved_at is None or created_at < solved_at):
+                solved_at = created_at
+            if status != Attempt.IN_PROGRESS and reason != Attempt.TIMEOUT:
+                attempts += 1
+
+        failures, improved_at = 0, None
+        for score, status, reason, created_at in rows:
+            if status == Attempt.INCORRECT \
+                    and reason not in (Attempt.TIMEOUT, Attempt.JUDGE_ERROR) \
+                    and (solved_at is None or created_at < solved_at):
+                failures += 1
+            if best and score == best and (improved_at is None or created_at < improved_at):
+                improved_at = created_at
+        return best, solved_at, attempts, failures, improved_at
+
+    @classmethod
+    def refresh(cls, user_id, part_id):
+        """
+        Recomputes the row for one user and part from their attempts. The
+        returned row's `changed` tells whether anything in it changed.
+        """
+        with transaction.atomic():
+            best, created = cls.objects.select_for_update() \
+                    .get_or_create(user_id=user_id, part_id=part_id)
+            rows = Attempt.objects.filter(owner_id=user_id, part_id=part_id) \
+                    .values_list('score', 'status', 'reason', 'created_at')
+            tally = cls.tally(rows)
+            best.changed = created or tally != tuple(getattr(best, field) for field in cls.FIELDS)
+            for field, value in zip(cls.FIELDS, tally):
+                setattr(best, field, value)
+            best.save()
+        return best
+
+    @classmethod
+    def update_for(cls, attempt):
+        return cls.refresh(attempt.owner_id, attempt.part_id)
+
+    def __str__(self):
+        return "%s: %s (%d)" % (self.user, self.part.name, self.score)
 
 class Clarification(models.Model):
     owner = models.ForeignKey(User)
@@ -199,3 +412,29 @@ class Clarification(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+
+class Event(models.Model):
+    """
+    A message for the live event streams. Web processes tail this table, so
+    judging workers in other processes can publish too. Events without a
+    user go to everyone watching the contest.
+    """
+    VERDICT = "verdict"
+    STANDING = "standing"
+    CLARIFICATION = "clarification"
+
+    contest = models.ForeignKey(Contest, related_name="+")
+    user = models.ForeignKey(User, null=True, blank=True, related_name="+")
+    kind = models.CharField(max_length=16)
+    data = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return "%s event #%d" % (self.kind, self.id)
+
+# Every app loads its models at startup, so this is where per-connection
+# tuning (WAL mode on SQLite) gets hooked up.
+db.register()
@@ -0,0 +1,108 @@
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+from judge import settings
+from judge.checkers import CHUNK_SIZE
+
+# Rough ratio between the size of a normalized oracle held as Python
+# objects and the size of the file it was read from.
+OVERHEAD = 8
+
+def file_digest(path):
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        chunk = f.read(CHUNK_SIZE)
+        while chunk:
+            sha.update(chunk)
+            chunk = f.read(CHUNK_SIZE)
+    return sha.hexdigest()
+
+class OracleStore:
+    """
+    Process-wide LRU cache of normalized oracle files. Files are keyed by
+    content hash, so identical test files share one entry, and the hash of a
+    path is only recomputed when its size or mtime changes.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.used = 0
+        self.entries = OrderedDict()
+        self.digests = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def digest(self, path, stat=None):
+        stat = stat or os.stat(path)
+        known = self.digests.get(path)
+        if known and known[:2] == (stat.st_mtime, stat.st_size):
+            return known[2]
+        digest = file_digest(path)
+        self.digests[path] = (stat.st_mtime, stat.st_size, digest)
+        return digest
+
+    def index(self, directory):
+        """
+        Hashes every test file under a directory ahead of time.
+        """
+        count = 0
+        for root, dirs, files in os.walk(directory):
+            for name in files:
+                self.digest(os.path.join(root, name))
+                count += 1
+        return count
+
+    def get(self, path, checker):
+        """
+        Returns the oracle at `path` prepared for `checker`, or None when
+        the checker cannot be cached or the file is too large to keep.
+        """
+        if not checker.cacheable:
+            return None
+        stat = os.stat(path)
+        cost = stat.st_size * OVERHEAD
+        if cost > self.budget // 4:
+            return None
+
+        key = (self.digest(path, stat), checker.name, checker.arg)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        with open(path, "r", buffering=CHUNK_SIZE) as oracle:
+            prepared = checker.prepare(oracle)
+
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = (prepared, cost)
+                self.used += cost
+                while self.used > self.budget and self.entries:
+                    old, (data, oldcost) = self.entries.popitem(last=False)
+                    self.used -= oldcost
+                    self.evictions += 1
+        return prepared
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.used = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'indexed': len(self.digests),
+            'used_bytes': self.used,
+            'budget_bytes': self.budget,
+        }
+
+oracle_store = OracleStore(settings.JUDGE_ORACLE_CACHE_BYTES)
@@ -0,0 +1,116 @@
+"""
+ICPC-style ranking. Teams are ordered by total score, then by penalty
+(minutes from the start of the contest to each solved part, plus
+JUDGE_PENALTY_MINUTES for every rejected submission before the solve,
+whether wrong or badly formatted; timeouts and attempts the judge failed
+on cost nothing), then by who reached their score first.
+"""
+from bisect import bisect_left, insort
+from itertools import groupby
+from judge import settings
+from judge.models import Attempt, BestScore
+
+class Standing:
+    __slots__ = ('score', 'penalty', 'last')
+
+    def __init__(self, score=0, penalty=0, last=None):
+        self.score = score
+        self.penalty = penalty
+        self.last = last
+
+    def key(self):
+        return (-self.score, self.penalty, self.last.timestamp() if self.last else 0.0)
+
+def standing(contest, rows):
+    """
+    Sums one team's (score, solved_at, failures, improved_at) rows, one
+    per part, into its Standing.
+    """
+    result = Standing()
+    for score, solved_at, failures, improved_at in rows:
+        result.score += score
+        if solved_at is not None:
+            minutes = int((solved_at - contest.begin_at).total_seconds() // 60)
+            result.penalty += max(0, minutes) + failures * settings.JUDGE_PENALTY_MINUTES
+        if score and improved_at is not None and (result.last is None or improved_at > result.last):
+            result.last = improved_at
+    return result
+
+class Ranking:
+    """
+    Teams kept sorted by Standing.key(). A rank is a binary search, and
+    moving a team after a verdict is a binary search plus a list insert,
+    so neither needs a full sort.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.standings = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def update(self, user_id, new):
+        old = self.standings.get(user_id)
+        if old is not None:
+            del self.entries[bisect_left(self.entries, (old.key(), user_id))]
+        self.standings[user_id] = new
+        insort(self.entries, (new.key(), user_id))
+
+    def get(self, user_id):
+        return self.standings.get(user_id) or Standing()
+
+    def rank_of(self, standing):
+        """
+        The competition rank ("1, 2, 2, 4") a team with `standing` has.
+        """
+        return bisect_left(self.entries, (standing.key(),)) + 1
+
+    def rank(self, user_id):
+        return self.rank_of(self.get(user_id))
+
+    def slice(self, first, last):
+        return [(self.rank_of(self.standings[user_id]), user_id, self.standings[user_id])
+                for key, user_id in self.entries[max(0, first):last]]
+
+    def top(self, count):
+        return self.slice(0, count)
+
+    def around(self, user_id, count):
+        """
+        The `count` teams either side of a team, as (rank, user id,
+        standing) triples.
+        """
+        standing = self.standings.get(user_id)
+        if standing is None:
+            position = bisect_left(self.entries, (Standing().key(),))
+        else:
+            position = bisect_left(self.entries, (standing.key(), user_id))
+        return self.slice(position - count, position + count + 1)
+
+def grouped_rows(scores):
+    """
+    Groups BestScore rows by user into (user id, standing rows) pairs.
+    """
+    rows = scores.order_by('user').values_list('user', 'score', 'solved_at', 'failures', 'improved_at')
+    for user_id, group in groupby(rows, key=lambda row: row[0]):
+        yield user_id, [row[1:] for row in group]
+
+def frozen_tallies(contest):
+    """
+    The BestScore.tally of every (user id, part id) counting only attempts
+    submitted before the contest's freeze.
+    """
+    rows = Attempt.objects.filter(part__problem__contest=contest, created_at__lt=contest.freeze_at) \
+            .order_by('owner', 'part').values_list('owner', 'part', 'score', 'status', 'reason', 'created_at')
+    return dict((key, BestScore.tally(row[2:] for row in group))
+            for key, group in groupby(rows.iterator(), key=lambda row: row[:2]))
+
+def frozen_ranking(contest, tallies):
+    ranking = Ranking()
+    by_user = {}
+    for (user_id, part_id), (score, solved_at, attempts, failures, improved_at) in tallies.items():
+        by_user.setdefault(user_id, []).append((score, solved_at, failures, improved_at))
+    for user_id, rows in by_user.items():
+        ranking.update(user_id, standing(contest, rows))
+    return ranking
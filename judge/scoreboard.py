@@ -0,0 +1,186 @@
+from datetime import timedelta
+from django.core.cache import get_cache
+from django.db.models import Sum
+from django.template.loader import render_to_string
+from django.utils import timezone
+import hashlib
+import threading
+import time
+from judge import settings
+from judge.models import BestScore
+from judge.ranking import Ranking, standing, grouped_rows, frozen_tallies, frozen_ranking
+
+cache = get_cache('scoreboard')
+
+# Rows changed this close to a process's last sync are read again, to allow
+# for clock skew between the processes writing BestScore.
+SYNC_SLACK = timedelta(seconds=5)
+
+_rankings = {}
+_frozen = {}
+_lock = threading.Lock()
+
+def team_key(contest_id, user_id):
+    """
+    Identifies a team's scoreboard row to live updates without revealing
+    who it is while names are hidden.
+    """
+    key = "%s:%d:%d" % (settings.SECRET_KEY, contest_id, user_id)
+    return hashlib.md5(key.encode()).hexdigest()[:12]
+
+class ScoreboardRow:
+    def __init__(self, team, problems, standing, key=None):
+        self.team = team
+        self.problems = problems
+        self.score = sum(score for problem, score in problems)
+        self.penalty = standing.penalty
+        self.standing = standing
+        self.key = key
+        self.rank = None
+
+    def sort_key(self):
+        return self.standing.key()
+
+    def __str__(self):
+        return str(self.team)
+
+def best_scores(contest):
+    """
+    Returns a dict mapping (user id, part id) to the best score that user
+    has achieved on that part, read from the BestScore table in one query.
+    """
+    rows = BestScore.objects.filter(part__problem__contest=contest) \
+            .values_list('user', 'part', 'score')
+    return dict(((user, part), best) for user, part, best in rows)
+
+def live_ranking(contest):
+    """
+    Returns this process's Ranking of the contest, first applying the
+    teams whose BestScore rows changed since the last call. rebuild_scores
+    bumps the "ranking" version, which starts over from scratch.
+    """
+    generation = get_version(contest.id, "ranking")
+    now = timezone.now()
+    with _lock:
+        entry = _rankings.get(contest.id)
+        scores = BestScore.objects.filter(part__problem__contest=contest)
+        if entry is None or entry[0] != generation:
+            ranking = Ranking()
+        else:
+            ranking = entry[2]
+            changed = scores.filter(updated_at__gte=entry[1] - SYNC_SLACK).values('user')
+            scores = scores.filter(user__in=changed)
+        for user_id, rows in grouped_rows(scores):
+            ranking.update(user_id, standing(contest, rows))
+        _rankings[contest.id] = (generation, now, ranking)
+    return ranking
+
+def frozen_board(contest):
+    """
+    Returns the per-part tallies and Ranking of the frozen scoreboard,
+    recomputed only when an attempt from before the freeze is (re)scored.
+    """
+    version = get_version(contest.id, "frozen")
+    with _lock:
+        entry = _frozen.get(contest.id)
+    if entry is None or entry[0] != (version, contest.freeze_at):
+        tallies = frozen_tallies(contest)
+        entry = ((version, contest.freeze_at), tallies, frozen_ranking(contest, tallies))
+        with _lock:
+            _frozen[contest.id] = entry
+    return entry[1], entry[2]
+
+def build_scoreboard(contest, frozen=False):
+    """
+    Computes the ranked scoreboard for a contest, or with `frozen` the one
+    that only counts attempts submitted before the freeze. The whole board
+    is built from a constant number of queries.
+    """
+    problems = list(contest.problems.prefetch_related('parts'))
+    if frozen:
+        tallies, ranking = frozen_board(contest)
+        best = dict((key, tally[0]) for key, tally in tallies.items())
+    else:
+        best = best_scores(contest)
+        ranking = live_ranking(contest)
+    return problems, ranked_rows(contest, problems, best, ranking)
+
+def ranked_rows(contest, problems, best, ranking):
+    """
+    Builds the sorted, ranked ScoreboardRows of every contestant from the
+    best score per (user id, part id) and the teams' Ranking.
+    """
+    rows = []
+    for team in contest.contestants.all():
+        breakdown = []
+        for problem in problems:
+            points = sum(best.get((team.id, part.id), 0) for part in problem.parts.all())
+            breakdown.append((problem, points))
+        rows.append(ScoreboardRow(team, breakdown, ranking.get(team.id), team_key(contest.id, team.id)))
+
+    rows.sort(key=ScoreboardRow.sort_key)
+
+    rank = 0
+    previous = None
+    for position, row in enumerate(rows, 1):
+        if row.sort_key() != previous:
+            rank = position
+            previous = row.sort_key()
+        row.rank = rank
+    return rows
+
+def team_standing(contest, user_id):
+    """
+    One team's live scoreboard row for live updates: its per-problem
+    scores, total, penalty, rank and sort key.
+    """
+    ranking = live_ranking(contest)
+    current = ranking.get(user_id)
+    problems = BestScore.objects.filter(user_id=user_id, part__problem__contest=contest) \
+            .values_list('part__problem').annotate(Sum('score'))
+    return {
+        'team': team_key(contest.id, user_id),
+        'problems': dict(problems),
+        'score': current.score,
+        'penalty': current.penalty,
+        'rank': ranking.rank(user_id),
+        'sort': list(current.key()),
+    }
+
+def get_version(contest_id, name="version"):
+    """
+    Returns the time the contest's scoreboard (or, by name, its "frozen"
+    board or "ranking" generation) last changed. A missing entry (cold or
+    evicted cache) starts a new version.
+    """
+    key = "scoreboard:%d:%s" % (contest_id, name)
+    version = cache.get(key)
+    if version is None:
+        version = time.time()
+        cache.add(key, version, None)
+    return version
+
+def bump_version(contest_id, name="version"):
+    cache.set("scoreboard:%d:%s" % (contest_id, name), time.time(), None)
+
+def get_etag(contest_id, version, shownames, user):
+    # The page header shows the viewer's name and score, so the ETag is per
+    # viewer even though the table is shared.
+    key = "%d:%r:%d:%s" % (contest_id, version, shownames, user.pk)
+    return '"%s"' % hashlib.md5(key.encode()).hexdigest()
+
+def render_table(contest, version, shownames, frozen=False):
+    """
+    Returns the rendered scoreboard table, rebuilding it only when the
+    version changed. Named, anonymous and frozen variants are cached
+    separately.
+    """
+    key = "scoreboard:%d:%r:%s:%s" % (contest.id, version, "named" if shownames else "hidden",
+            "frozen" if frozen else "live")
+    table = cache.get(key)
+    if table is None:
+        problems, teams = build_scoreboard(contest, frozen)
+        table = render_to_string("scoreboard_table.html",
+                {'problems': problems, 'teams': teams, 'shownames': shownames})
+        cache.set(key, table, None)
+    return table
@@ -17,6 +17,8 @@ PROJECT_DIR = os.path.dirname(os.path.realpath(project_module.__file__))
 
 PROBLEM_DIR = os.path.join(PROJECT_DIR, "assets", "problems")
 SECRET_DIR = os.path.join(PROJECT_DIR, "secret")
+TESTFILES_PER_PART = 5000
+BUNDLE_DIR = os.path.join(PROJECT_DIR, "bundles")
 SUBMISSION_DIR = os.path.join(PROJECT_DIR, "submissions")
 
 # Quick-start development settings - unsuitable for production
@@ -54,6 +56,7 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'judge.middleware.Instrument',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -61,7 +64,7 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'judge.middleware.CheckAttempts',
+    'judge.middleware.RequestContext',
 )
 
 TEMPLATE_CONTEXT_PROCESSORS = (
@@ -80,11 +83,56 @@ ROOT_URLCONF = 'judge.urls'
 # Database
 # https://docs.djangoproject.com/en/1.6/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+# SQLite is the default and is fine for development; judge.db switches it to
+# WAL so readers don't block the writer, and writers wait up to
+# JUDGE_DB_BUSY_TIMEOUT seconds for the lock instead of failing.
+# For contests, set JUDGE_DB_ENGINE=postgresql and the JUDGE_DB_* variables.
+# Connections are kept open for JUDGE_DB_CONN_MAX_AGE seconds; behind a
+# pooler such as PgBouncer (JUDGE_DB_POOLER=1, pointing HOST/PORT at it)
+# they are closed after every request and the pooler does the reuse.
+
+JUDGE_DB_ENGINE = os.environ.get('JUDGE_DB_ENGINE', 'sqlite')
+
+JUDGE_DB_POOLER = os.environ.get('JUDGE_DB_POOLER', '') not in ('', '0')
+
+JUDGE_DB_CONN_MAX_AGE = 0 if JUDGE_DB_POOLER else int(os.environ.get('JUDGE_DB_CONN_MAX_AGE', 60))
+
+JUDGE_DB_BUSY_TIMEOUT = float(os.environ.get('JUDGE_DB_BUSY_TIMEOUT', 20))
+
+if JUDGE_DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql_psycopg2',
+            'NAME': os.environ.get('JUDGE_DB_NAME', 'judge'),
+            'USER': os.environ.get('JUDGE_DB_USER', 'judge'),
+            'PASSWORD': os.environ.get('JUDGE_DB_PASSWORD', ''),
+            'HOST': os.environ.get('JUDGE_DB_HOST', ''),
+            'PORT': os.environ.get('JUDGE_DB_PORT', ''),
+            'CONN_MAX_AGE': JUDGE_DB_CONN_MAX_AGE,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('JUDGE_DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+            'CONN_MAX_AGE': JUDGE_DB_CONN_MAX_AGE,
+            'OPTIONS': {'timeout': JUDGE_DB_BUSY_TIMEOUT},
+        }
     }
+
+# Caches
+# The scoreboard cache is shared by the web and judging processes on a
+# host, so it uses the file backend.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'scoreboard': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(PROJECT_DIR, "cache", "scoreboard"),
+    },
 }
 
 # Internationalization
@@ -112,4 +160,63 @@ STATICFILES_DIRS = (
         os.path.join(PROJECT_DIR, 'assets'),
 )
 
-SENDFILE_BACKEND = "sendfile.backends.development"
+# File downloads are streamed by Django unless a front-end server takes
+# over: "xsendfile" sends X-Sendfile, "nginx" sends X-Accel-Redirect to
+# JUDGE_SENDFILE_URL plus the path relative to JUDGE_SENDFILE_ROOT.
+
+JUDGE_SENDFILE = None
+
+JUDGE_SENDFILE_ROOT = PROJECT_DIR
+
+JUDGE_SENDFILE_URL = "/protected/"
+
+# Judging queue
+# Uploads are queued and scored by `manage.py judged`. Set JUDGE_ASYNC to
+# False to score inside the upload request instead.
+
+JUDGE_ASYNC = True
+
+JUDGE_QUEUE_LEASE = 60
+
+JUDGE_QUEUE_MAX_TRIES = 3
+
+# Memory budget of the per-process cache of normalized oracle files.
+
+JUDGE_ORACLE_CACHE_BYTES = 256 * 1024 * 1024
+
+# Request instrumentation (judge.middleware.Instrument), off by default.
+# Each process keeps the last JUDGE_INSTRUMENT_RING samples per view and
+# dumps them to JUDGE_INSTRUMENT_DIR every JUDGE_INSTRUMENT_FLUSH seconds.
+# JUDGE_INSTRUMENT_PROFILE = N runs cProfile on one request in N.
+
+JUDGE_INSTRUMENT = False
+
+JUDGE_INSTRUMENT_RING = 1000
+
+JUDGE_INSTRUMENT_FLUSH = 30
+
+JUDGE_INSTRUMENT_PROFILE = 0
+
+JUDGE_INSTRUMENT_DIR = os.path.join(PROJECT_DIR, "cache", "instrument")
+
+# Live events (judge.events). Each web process tails the Event table every
+# JUDGE_EVENTS_POLL seconds and pushes new events to its open streams.
+# A stream holds its worker for as long as the browser is connected, so
+# only turn JUDGE_EVENTS on once /contest/<slug>/events/ is routed to async
+# workers (gunicorn -k gevent judge.wsgi) rather than the sync ones serving
+# the rest of the site. While it is off the pages don't open a stream and
+# have to be reloaded to show new verdicts, as before.
+
+JUDGE_EVENTS = False
+
+JUDGE_EVENTS_POLL = 0.5
+
+JUDGE_EVENTS_KEEP = 3600
+
+# Minutes of penalty for each rejected submission before a part is solved.
+
+JUDGE_PENALTY_MINUTES = 20
+
+# Where the per-contest scoreboard history logs (judge.history) are kept.
+
+JUDGE_HISTORY_DIR = os.path.join(PROJECT_DIR, "history")
@@ -0,0 +1,4 @@
+-- Pending attempts are a tiny fraction of the table but are looked up on
+-- every start_submit and by every expiry sweep.
+CREATE INDEX judge_attempt_pending_owner ON judge_attempt (owner_id, part_id) WHERE status = 1;
+CREATE INDEX judge_attempt_pending_expiry ON judge_attempt (expires_at) WHERE status = 1;
@@ -20,7 +20,6 @@ def contest_score(context, contest):
 @register.assignment_tag(takes_context=True)
 def user_is_contestant(context, contest):
     request = context['request']
-    print(contest)
     return contest.has_contestant(request.user)
 
 @register.assignment_tag(takes_context=True)
@@ -0,0 +1,38 @@
+from collections import namedtuple
+import threading
+import time
+from judge.models import TestFile
+
+# How long a process trusts its copy of a part's index before reloading it,
+# so that a later prepare_contest run is picked up.
+INDEX_TTL = 60
+
+FileInfo = namedtuple('FileInfo', ['st_size', 'st_mtime'])
+
+_index = {}
+_lock = threading.Lock()
+
+def load_index(part_id):
+    rows = TestFile.objects.filter(part_id=part_id) \
+            .values_list('kind', 'number', 'size', 'mtime', 'compressed_size')
+    return dict(((kind, number), (size, mtime, compressed)) for kind, number, size, mtime, compressed in rows)
+
+def lookup(part_id, kind, number):
+    """
+    Returns (FileInfo, compressed FileInfo or None) for an indexed test file,
+    or None if the part has no index entry for it. Each process loads a
+    part's index with one query and keeps it for INDEX_TTL seconds.
+    """
+    now = time.time()
+    with _lock:
+        entry = _index.get(part_id)
+    if entry is None or entry[0] < now:
+        entry = (now + INDEX_TTL, load_index(part_id))
+        with _lock:
+            _index[part_id] = entry
+
+    found = entry[1].get((kind, number))
+    if found is None:
+        return None
+    size, mtime, compressed = found
+    return FileInfo(size, mtime), (FileInfo(compressed, mtime) if compressed is not None else None)
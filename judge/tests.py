@@ -0,0 +1,390 @@
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import zipfile
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.core.management.base import CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from judge import history, scoreboard, settings
+from judge.util import save_result
+from judge.judging import claim, enqueue
+from judge.models import Attempt, BestScore, Contest, Event, JudgeTask, Problem, ProblemPart, get_testfile_path
+from judge.benchmarks import create_contest, create_users, seed_attempts, secret_dir
+from judge.management.commands.explain_queries import hot_queries, explain, scans_attempts
+from judge.management.commands.generate_tests import generate
+
+def make_contest(slug, problems, teams):
+    """
+    A running contest with `teams` contestants who have each submitted a
+    few attempts, with BestScore rebuilt from them.
+    """
+    contest = create_contest(slug, problems=problems, parts=2)
+    users = [User.objects.create(username="%s-%d" % (slug, i)) for i in range(teams)]
+    contest.contestants.add(*users)
+    seed_attempts(contest, users, per_team=4)
+    return contest
+
+def scratch_dir(test, name):
+    """
+    Points the directory setting `name` at a scratch directory for the
+    duration of `test`.
+    """
+    directory = tempfile.mkdtemp(prefix="judge-test-")
+    test.addCleanup(shutil.rmtree, directory)
+    test.addCleanup(setattr, settings, name, getattr(settings, name))
+    setattr(settings, name, directory)
+
+def always_right(answer, oracle):
+    return True
+
+def columns(table):
+    cursor = connection.cursor()
+    return set(column[0] for column in connection.introspection.get_table_description(cursor, table))
+
+class UpgradeSchemaTest(TestCase):
+    def test_up_to_date(self):
+        out = io.StringIO()
+        call_command('upgrade_schema', dry_run=True, stdout=out)
+        self.assertEqual(out.getvalue(), "")
+
+    @unittest.skipUnless(connection.vendor == 'sqlite' and sqlite3.sqlite_version_info >= (3, 35),
+            "needs ALTER TABLE ... DROP COLUMN")
+    def test_adds_missing_columns(self):
+        cursor = connection.cursor()
+        cursor.execute("ALTER TABLE judge_contest DROP COLUMN freeze_at")
+        cursor.execute("ALTER TABLE judge_bestscore DROP COLUMN failures")
+
+        out = io.StringIO()
+        call_command('upgrade_schema', stdout=out)
+        self.assertIn("Added 2 column(s)", out.getvalue())
+        self.assertIn("rebuild_scores", out.getvalue())
+        self.assertIn('freeze_at', columns('judge_contest'))
+        self.assertIn('failures', columns('judge_bestscore'))
+
+        out = io.StringIO()
+        call_command('upgrade_schema', dry_run=True, stdout=out)
+        self.assertEqual(out.getvalue(), "")
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "reads SQLite query plans")
+class QueryPlanTest(TestCase):
+    def setUp(self):
+        self.contest = create_contest("plans", problems=3, parts=2)
+        seed_attempts(self.contest, create_users(self.contest, 5), per_team=10)
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in hot_queries(self.contest).items():
+            plan = explain(queryset)
+            self.assertFalse(scans_attempts(plan), "%s scans judge_attempt:\n%s" % (name, "\n".join(plan)))
+
+class ScoreboardQueriesTest(TestCase):
+    def setUp(self):
+        # Start every board from scratch rather than from another test's
+        # cached ranking of a contest with the same id.
+        scoreboard._rankings.clear()
+        scoreboard._frozen.clear()
+
+    def assertSameQueries(self, build, small, large):
+        with CaptureQueriesContext(connection) as captured:
+            build(small)
+        with self.assertNumQueries(len(captured)):
+            build(large)
+
+    def test_independent_of_teams_and_problems(self):
+        small = make_contest("small", problems=1, teams=2)
+        large = make_contest("large", problems=8, teams=40)
+        self.assertSameQueries(scoreboard.build_scoreboard, small, large)
+        # Again, now from the cached rankings.
+        self.assertSameQueries(scoreboard.build_scoreboard, small, large)
+
+    def test_frozen_independent_of_teams_and_problems(self):
+        small = make_contest("small", problems=1, teams=2)
+        large = make_contest("large", problems=8, teams=40)
+        for contest in (small, large):
+            contest.freeze_at = contest.begin_at + timedelta(minutes=30)
+        build = lambda contest: scoreboard.build_scoreboard(contest, frozen=True)
+        self.assertSameQueries(build, small, large)
+        self.assertSameQueries(build, small, large)
+
+class ScoreboardCachingTest(TestCase):
+    def test_revalidates_by_etag_only(self):
+        create_contest("cached")
+        url = reverse('scoreboard', kwargs={'contest': "cached"})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        scoreboard.bump_version(Contest.objects.get(slug="cached").id)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'],
+                HTTP_IF_MODIFIED_SINCE="Fri, 01 Jan 2100 00:00:00 GMT")
+        self.assertEqual(response.status_code, 200)
+
+class ContestPageQueriesTest(TestCase):
+    def test_independent_of_problems(self):
+        user = User.objects.create_user("contestant", password="secret")
+        contests = [make_contest("one", problems=1, teams=2), make_contest("many", problems=12, teams=2)]
+        for contest in contests:
+            contest.contestants.add(user)
+            BestScore.objects.bulk_create([BestScore(user=user, part=part, score=part.points)
+                    for part in ProblemPart.objects.filter(problem__contest=contest)])
+        self.client.login(username="contestant", password="secret")
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('contest_home', kwargs={'contest': "one"}))
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(len(captured)):
+            response = self.client.get(reverse('contest_home', kwargs={'contest': "many"}))
+        self.assertEqual(len(response.context['problems']), 12)
+
+class ImportContestTest(TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="judge-test-")
+        self.addCleanup(shutil.rmtree, self.workdir)
+        secret = secret_dir()
+        secret.__enter__()
+        self.addCleanup(secret.__exit__, None, None, None)
+
+    def manifest(self, slug="imported", problem="sum"):
+        return {
+            'name': "Imported", 'slug': slug, 'description': "",
+            'begin_at': "2026-01-01 10:00", 'end_at': "2026-01-01 15:00",
+            'problems': [{
+                'name': "Sum", 'slug': problem, 'order': "A", 'time_limit': 600,
+                'pdf': "statement.pdf", 'sample_input': "sample.in", 'sample_output': "sample.out",
+                'parts': [{'name': "small", 'points': 10}],
+            }],
+        }
+
+    def package(self, manifest, problem="sum"):
+        path = os.path.join(self.workdir, "%s.zip" % manifest['slug'])
+        with zipfile.ZipFile(path, "w") as archive:
+            archive.writestr("contest.json", json.dumps(manifest))
+            archive.writestr("statement.pdf", b"%PDF-1.4")
+            archive.writestr("sample.in", "1 2\n")
+            archive.writestr("sample.out", "3\n")
+            archive.writestr("%s/inputs/small-0.in" % problem, "%s 2 3\n" % manifest['slug'])
+            archive.writestr("%s/outputs/small-0.out" % problem, "5\n")
+        return path
+
+    def import_package(self, manifest, problem="sum"):
+        call_command('import_contest', self.package(manifest, problem), count=1,
+                stdout=io.StringIO(), stderr=io.StringIO())
+        contest = Contest.objects.get(slug=manifest['slug'])
+        self.addCleanup(shutil.rmtree, os.path.join(settings.SUBMISSION_DIR, "%d-%s" % (contest.id, contest.slug)), True)
+        return contest
+
+    def test_imports_package(self):
+        contest = self.import_package(self.manifest())
+        problem = contest.problems.get()
+        self.assertEqual((problem.slug, problem.order, problem.time_limit), ("sum", "A", 600))
+        self.assertEqual(list(problem.parts.values_list('name', 'points')), [("small", 10)])
+        with open(problem.sampleoutput.path) as f:
+            self.assertEqual(f.read(), "3\n")
+        with open(get_testfile_path("inputs", "sum", "small", 0)) as f:
+            self.assertEqual(f.read(), "imported 2 3\n")
+
+    def test_rejects_incomplete_manifest(self):
+        manifest = self.manifest()
+        del manifest['problems'][0]['time_limit']
+        del manifest['problems'][0]['parts'][0]['points']
+        with self.assertRaises(CommandError):
+            call_command('import_contest', self.package(manifest), count=1, stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertFalse(Contest.objects.exists())
+
+    def test_refuses_reused_problem_slug(self):
+        self.import_package(self.manifest())
+        with self.assertRaises(CommandError):
+            self.import_package(self.manifest(slug="other"))
+        with open(get_testfile_path("inputs", "sum", "small", 0)) as f:
+            self.assertEqual(f.read(), "imported 2 3\n")
+
+class SubmitTest(TestCase):
+    def setUp(self):
+        self.contest = create_contest("submit")
+        self.user = User.objects.create_user("contestant", password="secret")
+        self.contest.contestants.add(self.user)
+        self.part = ProblemPart.objects.get(problem__contest=self.contest)
+        self.client.login(username="contestant", password="secret")
+
+    def submit(self, attempt):
+        url = reverse('problem_submit', kwargs={'contest': "submit", 'slug': self.part.problem.slug,
+                'part': self.part.name, 'attempt_pk': attempt.pk})
+        return self.client.post(url, {'outputfile': SimpleUploadedFile("out.txt", b"42\n")})
+
+    def test_rejects_upload_after_deadline(self):
+        attempt = Attempt(owner=self.user, part=self.part, expires_at=timezone.now() - timedelta(hours=1))
+        attempt.save()
+        response = self.submit(attempt)
+        self.assertEqual(response.status_code, 403)
+        self.assertContains(response, "This attempt has expired!", status_code=403)
+        self.assertNotContains(response, 'type="submit"', status_code=403)
+
+        attempt = Attempt.objects.get(pk=attempt.pk)
+        self.assertEqual((attempt.status, attempt.reason), (Attempt.INCORRECT, Attempt.TIMEOUT))
+        self.assertFalse(attempt.outputfile)
+        self.assertFalse(JudgeTask.objects.exists())
+
+class EventsTest(TestCase):
+    def setUp(self):
+        scratch_dir(self, 'JUDGE_HISTORY_DIR')
+
+    def test_off_by_default(self):
+        contest = create_contest("quiet")
+        user = User.objects.create_user("contestant", password="secret")
+        contest.contestants.add(user)
+        part = ProblemPart.objects.get(problem__contest=contest)
+        self.client.login(username="contestant", password="secret")
+
+        response = self.client.get(reverse('scoreboard', kwargs={'contest': "quiet"}))
+        self.assertNotContains(response, "EventSource")
+        response = self.client.get(reverse('contest_events', kwargs={'contest': "quiet"}))
+        self.assertEqual(response.status_code, 404)
+
+        attempt = Attempt(owner=user, part=part, status=Attempt.CORRECT, reason=Attempt.ACCEPTED, score=part.points)
+        attempt.save()
+        save_result(Attempt.objects.select_related('part__problem__contest').get(pk=attempt.pk))
+        self.assertFalse(Event.objects.exists())
+
+class RebuildScoresTest(TestCase):
+    def test_verify_ignores_unjudged_attempts(self):
+        contest = make_contest("verify", problems=2, teams=3)
+        user = contest.contestants.first()
+        part = ProblemPart.objects.create(problem=contest.problems.first(), name="extra", points=5, order=9)
+        # A pending and a timed-out attempt on a part the team never got
+        # scored on: no BestScore row, and none is expected.
+        Attempt(owner=user, part=part).save()
+        Attempt(owner=user, part=part, status=Attempt.INCORRECT, reason=Attempt.TIMEOUT).save()
+        call_command('rebuild_scores', verify=True, stdout=io.StringIO())
+
+        BestScore.objects.filter(user=user).exclude(part=part).update(score=12345)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_scores', verify=True, stdout=io.StringIO())
+
+class TallyTest(unittest.TestCase):
+    def test_failures_before_solve(self):
+        start = timezone.now()
+        at = lambda minutes: start + timedelta(minutes=minutes)
+        rows = [
+            (0, Attempt.INCORRECT, Attempt.WRONG_ANSWER, at(1)),
+            (0, Attempt.INCORRECT, Attempt.BAD_SUBMISSION, at(2)),
+            (0, Attempt.INCORRECT, Attempt.TIMEOUT, at(3)),
+            (0, Attempt.INCORRECT, Attempt.JUDGE_ERROR, at(4)),
+            (10, Attempt.CORRECT, Attempt.ACCEPTED, at(5)),
+            (0, Attempt.INCORRECT, Attempt.WRONG_ANSWER, at(6)),
+        ]
+        score, solved_at, attempts, failures, improved_at = BestScore.tally(rows)
+        self.assertEqual((score, solved_at, improved_at), (10, at(5), at(5)))
+        # The wrong answer and the badly formatted one before the solve.
+        self.assertEqual(failures, 2)
+        self.assertEqual(attempts, 5)
+
+class CheckerValidationTest(unittest.TestCase):
+    def test_rejects_arguments_the_checker_cannot_use(self):
+        for checker, arg in [("float", "tight"), ("float", "-1"), ("custom", ""), ("custom", "judge.no_such_module.check")]:
+            with self.assertRaises(ValidationError) as raised:
+                ProblemPart(checker=checker, checker_arg=arg).clean()
+            self.assertIn('checker_arg', raised.exception.message_dict)
+            self.assertRaises(ValidationError, Problem(checker=checker, checker_arg=arg).clean)
+
+    def test_accepts_usable_arguments(self):
+        for checker, arg in [("float", ""), ("float", "1e-4"), ("token", ""), ("custom", "judge.tests.always_right")]:
+            ProblemPart(checker=checker, checker_arg=arg).clean()
+            Problem(checker=checker, checker_arg=arg).clean()
+        # A part without its own checker uses the problem's, argument and all.
+        ProblemPart(checker="", checker_arg="tight").clean()
+
+class GenerateTestsTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="judge-test-")
+        self.addCleanup(shutil.rmtree, self.workdir)
+
+    def script(self, name, body):
+        path = os.path.join(self.workdir, name + ".py")
+        with open(path, "w") as f:
+            f.write("import sys\n" + body + "\n")
+        return path
+
+    def job(self, solution):
+        generator = self.script("generator", "print('new input')")
+        return (generator, solution, "small", 0, 1, os.path.join(self.workdir, "in"),
+                os.path.join(self.workdir, "out"), 10)
+
+    def test_keeps_old_pair_when_solution_fails(self):
+        for name in ("in", "out"):
+            with open(os.path.join(self.workdir, name), "w") as f:
+                f.write("old %s\n" % name)
+        self.assertIn("solution exited with 1", generate(self.job(self.script("solution", "sys.exit(1)"))))
+        self.assertEqual(sorted(os.listdir(self.workdir)), ["generator.py", "in", "out", "solution.py"])
+        for name in ("in", "out"):
+            with open(os.path.join(self.workdir, name)) as f:
+                self.assertEqual(f.read(), "old %s\n" % name)
+
+    def test_replaces_pair(self):
+        self.assertIsNone(generate(self.job(self.script("solution", "sys.stdout.write(sys.stdin.read().upper())"))))
+        with open(os.path.join(self.workdir, "out")) as f:
+            self.assertEqual(f.read(), "NEW INPUT\n")
+
+class HistoryTest(TestCase):
+    def setUp(self):
+        scratch_dir(self, 'JUDGE_HISTORY_DIR')
+
+    def test_late_verdict_does_not_leak_into_the_past(self):
+        contest = create_contest("history")
+        user = User.objects.create(username="team")
+        part = ProblemPart.objects.get(problem__contest=contest)
+        start = contest.begin_at.replace(microsecond=0)
+        attempts = []
+        for minutes in (10, 20):
+            attempt = Attempt(owner=user, part=part)
+            attempt.save()
+            Attempt.objects.filter(pk=attempt.pk).update(created_at=start + timedelta(minutes=minutes))
+            attempts.append(Attempt.objects.select_related('part__problem__contest').get(pk=attempt.pk))
+        older, newer = attempts
+
+        # The newer attempt is judged first, the older one later.
+        newer.status, newer.reason, newer.score = Attempt.CORRECT, Attempt.ACCEPTED, part.points
+        save_result(newer)
+        older.status, older.reason, older.score = Attempt.INCORRECT, Attempt.WRONG_ANSWER, 0
+        save_result(older)
+
+        at = lambda minutes: (start + timedelta(minutes=minutes)).timestamp()
+        live = [history.state_at(contest.id, at(minutes)) for minutes in (5, 15, 25)]
+        self.assertEqual(live[0], {})
+        self.assertEqual(live[1][(user.id, part.id)][:3], (0, None, 1))
+        self.assertEqual(live[2][(user.id, part.id)][:3], (part.points, newer.created_at, 1))
+
+        history.backfill(contest)
+        self.assertEqual([history.state_at(contest.id, at(minutes)) for minutes in (5, 15, 25)], live)
+
+class JudgingQueueTest(TestCase):
+    def setUp(self):
+        scratch_dir(self, 'JUDGE_HISTORY_DIR')
+
+    def test_fails_task_whose_worker_kept_dying(self):
+        contest = create_contest("queue")
+        attempt = Attempt(owner=User.objects.create(username="team"),
+                part=ProblemPart.objects.get(problem__contest=contest), outputfile="attempt.out")
+        attempt.save()
+        task = enqueue(attempt)
+        # Every try ended with the lease running out.
+        JudgeTask.objects.filter(pk=task.pk).update(tries=settings.JUDGE_QUEUE_MAX_TRIES,
+                leased_until=timezone.now() - timedelta(seconds=1), leased_by="dead")
+
+        self.assertIsNone(claim("worker"))
+        attempt = Attempt.objects.get(pk=attempt.pk)
+        self.assertEqual((attempt.status, attempt.reason), (Attempt.INCORRECT, Attempt.JUDGE_ERROR))
+        task = JudgeTask.objects.get(pk=task.pk)
+        self.assertIsNotNone(task.finished_at)
+        self.assertEqual(task.tries, settings.JUDGE_QUEUE_MAX_TRIES)
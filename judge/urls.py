@@ -11,6 +11,8 @@ urlpatterns = patterns('',
     url(r'^contest/(?P<contest>[-\w]+)/$', views.ContestView.as_view(), name='contest_home'),
     url(r'^contest/(?P<contest>[-\w]+)/enter/$', views.enter_contest, name='contest_enter'),
     url(r'^contest/(?P<contest>[-\w]+)/scoreboard/$', views.scoreboard, name='scoreboard'),
+    url(r'^contest/(?P<contest>[-\w]+)/scoreboard/history/$', views.scoreboard_history, name='scoreboard_history'),
+    url(r'^contest/(?P<contest>[-\w]+)/events/$', views.contest_events, name='contest_events'),
     url(r'^contest/(?P<contest>[-\w]+)/(?P<slug>[-\w]+)/', include(patterns('',
         url(r'^$', views.ProblemView.as_view(), name='problem_home'),
         url(r'^sample/$', views.ProblemInputOutputView.as_view(), name='problem_sample_io'),
@@ -32,11 +34,13 @@ urlpatterns = patterns('',
         url(r'^clarifications/$', views.AdminClarificationList.as_view(), name="clarification_list"),
         url(r'^clarifications/(?P<pk>\d+)/$', views.AdminClarificationRespond.as_view(), name="clarification_respond"),
         url(r'^submissions/$', views.AdminSubmissionList.as_view(), name="submission_list"),
+        url(r'^submissions/feed/$', views.admin_submission_feed, name="submission_feed"),
         url(r'^submissions/attempt/(?P<attempt_pk>\d+)/$', views.AdminAttemptDetail.as_view(), name="attempt_detail"),
         url(r'^submissions/attempt/(?P<attempt_pk>\d+)/override/(?P<action>.+?)/$', views.admin_attempt_override, name="attempt_override"),
         url(r'^submissions/attempt/(?P<attempt_pk>\d+)/code/$', views.AdminAttemptViewCode.as_view(), name="attempt_code"),
         url(r'^submissions/attempt/(?P<attempt_pk>\d+)/diff/$', views.admin_attempt_diff, name="attempt_diff"),
         url(r'^submissions/attempt/(?P<attempt_pk>\d+)/diff/quick/$', views.admin_attempt_diff, {'quick': True}, name="attempt_diff_quick"),
     ))),
+    url(r'^admin/profile/$', views.admin_profile, name="profile"),
     url(r'^admin/', include(admin.site.urls)),
 ) + staticfiles_urlpatterns()
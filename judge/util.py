@@ -1,33 +1,78 @@
-from judge.models import Attempt
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from collections import OrderedDict
+from judge.models import Attempt, BestScore
+from judge.checkers import get_checker, CHUNK_SIZE
+from judge.oracles import oracle_store
+from judge.scoreboard import bump_version
+from judge.instrument import timed
+from judge.events import publish_result
+from judge import history
 
-def score_line(mine, theirs):
-    return theirs.split() == mine.split()
+def percentiles(samples, points=(50, 90, 99)):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    result = OrderedDict()
+    for point in points:
+        index = min(len(ordered) - 1, int(round(point / 100.0 * (len(ordered) - 1))))
+        result["p%d" % point] = ordered[index]
+    result['max'] = ordered[-1]
+    return result
 
-def filter_lines(lines):
-    return [line for line in lines if line]
+def save_result(attempt):
+    """
+    Saves a scored attempt and updates the owner's best score for the part
+    in the same transaction, then announces the verdict to live streams.
+    """
+    with transaction.atomic():
+        attempt.save()
+        best = BestScore.update_for(attempt)
+    contest = attempt.part.problem.contest
+    if best.changed:
+        history.record(contest.id, attempt.owner_id, attempt.part_id, attempt.created_at)
+    bump_version(contest.id)
+    if contest.freeze_at and attempt.created_at < contest.freeze_at:
+        bump_version(contest.id, "frozen")
+    publish_result(attempt)
 
-def score(attempt):
-    with open(attempt.outputfile.path, "r") as answer:
-        with open(attempt.get_outputfile_path(), "r") as oracle:
-            answerlines = filter_lines(answer.readlines())
-            oraclelines = filter_lines(oracle.readlines())
-            
-            if len(answerlines) != len(oraclelines):
-                attempt.score = 0
-                attempt.status = Attempt.INCORRECT
-                attempt.reason = Attempt.BAD_SUBMISSION
-                attempt.save()
-                return
-            
-            if all(score_line(mine, theirs) for mine, theirs in zip(oraclelines, answerlines)):
-                attempt.score = attempt.part.points
-                attempt.status = Attempt.CORRECT
-                attempt.reason = Attempt.ACCEPTED
-                attempt.save()
-                return
+def expirable(attempts=None, now=None):
+    """
+    The pending attempts past their deadline. Attempts whose output was
+    uploaded are waiting to be judged and are left out.
+    """
+    if attempts is None:
+        attempts = Attempt.objects.all()
+    return attempts.filter(status=Attempt.IN_PROGRESS, expires_at__lte=now or timezone.now()) \
+            .filter(Q(outputfile='') | Q(outputfile__isnull=True))
+
+def expire_attempts(attempts=None, now=None):
+    """
+    Marks every expirable attempt as timed out with a single UPDATE. Pass a
+    queryset to restrict the sweep, e.g. to one user.
+    """
+    return expirable(attempts, now).update(status=Attempt.INCORRECT, reason=Attempt.TIMEOUT)
+
+def check_files(answer_path, oracle_path, checker):
+    expected = oracle_store.get(oracle_path, checker)
+    with open(answer_path, "r", buffering=CHUNK_SIZE) as answer:
+        if expected is not None:
+            return checker.check_prepared(answer, expected)
+        with open(oracle_path, "r", buffering=CHUNK_SIZE) as oracle:
+            return checker.check(answer, oracle)
 
-    attempt.score = 0
-    attempt.status = Attempt.INCORRECT
-    attempt.reason = Attempt.WRONG_ANSWER
-    attempt.save()
-    return
+def verdict(reason, points):
+    """
+    Returns the (status, score) an attempt gets for a checker's reason.
+    """
+    if reason == Attempt.ACCEPTED:
+        return Attempt.CORRECT, points
+    return Attempt.INCORRECT, 0
+
+@timed('score')
+def score(attempt):
+    attempt.reason = check_files(attempt.outputfile.path, attempt.get_outputfile_path(),
+            get_checker(attempt.part))
+    attempt.status, attempt.score = verdict(attempt.reason, attempt.part.points)
+    save_result(attempt)
@@ -1,15 +1,27 @@
 from django.shortcuts import redirect, render, get_object_or_404
+from django.template.loader import render_to_string
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse, HttpResponseNotFound
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotFound, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.views.generic import DetailView, ListView, CreateView, UpdateView
 from django.views.generic.base import ContextMixin
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils.dateparse import parse_datetime
 import django.contrib.messages
 from django.contrib.messages.views import SuccessMessageMixin
-from judge import models
-from judge.util import score
+from judge import models, settings, context
+from judge.util import score, save_result, expire_attempts
+from judge.scoreboard import get_version, get_etag, render_table, bump_version
+from judge.judging import enqueue
 from judge.forms import ClarificationForm, AdminClarificationForm
-from sendfile import sendfile
-from difflib import HtmlDiff
+from judge.files import serve_file, sample_cache
+from judge.testdata import lookup
+from judge.diff import attempt_diff
+from judge import instrument, events, history
+import io
+import json
+import math
 
 class ContestantMixin():
     def dipatch(self, request, *args, **kwargs):
@@ -40,18 +52,45 @@ def enter_contest(request, **kwargs):
 
         if not contest.has_contestant(user):
             contest.contestants.add(user)
+            context.forget_contests()
+            bump_version(contest.id)
  
         return redirect(reverse("contest_home", kwargs={'contest': contest.slug}))
 
     except models.Contest.DoesNotExist:
         return redirect(reverse("index", kwargs=kwargs))
 
+def load_contest_problems(contest, user):
+    """
+    Loads a contest's problems with their total points and the user's score
+    on each (-1 when the user isn't competing) in two queries, so that the
+    contest page does no per-problem ORM work.
+    """
+    problems = list(contest.problems.annotate(points_total=Sum('parts__points')))
+
+    scores = None
+    if contest.has_contestant(user):
+        scores = dict((row['part__problem'], row['total']) for row in
+                models.BestScore.objects.filter(user=user, part__problem__contest=contest) \
+                        .values('part__problem').annotate(total=Sum('score')).order_by())
+
+    for problem in problems:
+        problem.contest = contest
+        problem.points_total = problem.points_total or 0
+        problem.user_score = -1 if scores is None else scores.get(problem.id, 0)
+    return problems
+
 class ContestView(DetailView):
     model = models.Contest
     template_name = "contest.html"
     context_object_name = 'contest'
     slug_url_kwarg = 'contest'
 
+    def get_context_data(self, **kwargs):
+        ctxt = super().get_context_data(**kwargs)
+        ctxt['problems'] = load_contest_problems(self.object, self.request.user)
+        return ctxt
+
 class ProblemView(ContestantMixin, DetailView):
     model = models.Problem
     template_name = "problem.html"
@@ -61,16 +100,9 @@ class ProblemInputOutputView(DetailView):
     template_name = "sample_io.html"
 
     def get_context_data(self, object=None, **kwargs):
-        sampleinput = []
-        sampleoutput = []
-        with open(object.sampleinput.url, 'r') as infile:
-            sampleinput += infile.readlines()
-        with open(object.sampleoutput.url, 'r') as outfile:
-            sampleoutput += outfile.readlines()
-
         ctxt = super().get_context_data(object=object, **kwargs)
-        ctxt['sampleinput'] = "".join(sampleinput)
-        ctxt['sampleoutput'] = "".join(sampleoutput)
+        ctxt['sampleinput'] = sample_cache.read(object.sampleinput.path)
+        ctxt['sampleoutput'] = sample_cache.read(object.sampleoutput.path)
 
         return ctxt
 
@@ -86,6 +118,7 @@ def start_submit(request, **kwargs):
                 problem__contest__slug=kwargs['contest'],
                 name=kwargs['part']).get()
 
+        expire_attempts(user.attempts.filter(part=part))
         att = user.attempts.filter(part=part, status=models.Attempt.IN_PROGRESS).first()
         if att is None:
             att = models.Attempt(part=part, owner=user)
@@ -112,8 +145,23 @@ class SubmitView(ContestantMixin, UpdateView):
         return data
 
     def form_valid(self, form):
-        response = super().form_valid(form)
-        score(self.object)
+        # The row is locked while the deadline is checked, so the expiry
+        # sweep can't time the attempt out under the upload. The upload and
+        # its queue entry commit together, so an attempt can never be left
+        # uploaded but without a task.
+        with transaction.atomic():
+            late = not models.Attempt.objects.select_for_update().get(pk=self.object.pk).accepts_upload()
+            if not late:
+                response = super().form_valid(form)
+                if settings.JUDGE_ASYNC:
+                    enqueue(self.object)
+        if late:
+            # Time the attempt out and show it as expired.
+            expire_attempts(models.Attempt.objects.filter(pk=self.object.pk))
+            self.object = models.Attempt.objects.select_related('part__problem').get(pk=self.object.pk)
+            return self.render_to_response(self.get_context_data(form=form), status=403)
+        if not settings.JUDGE_ASYNC:
+            score(self.object)
         return response
 
     def get_success_url(self):
@@ -126,24 +174,35 @@ class SubmitView(ContestantMixin, UpdateView):
 def download_sample(request, contest=None, slug=None, file='input', **kwargs):
     problem = get_object_or_404(models.Problem, contest__slug=contest, slug=slug)
     samplefile = problem.sampleinput if file == 'input' else problem.sampleoutput
-    return sendfile(request, samplefile.path, attachment=True, attachment_filename=file+".txt")
+    return serve_file(request, samplefile.path, filename=file+".txt", private=False, max_age=300)
 
 def download_inputfile(request, randomness=None, **kwargs):
-    attempt = models.Attempt.objects.get(pk=kwargs['attempt_pk'])
-    path = attempt.get_inputfile_path()
+    attempt = get_object_or_404(models.Attempt.objects.select_related('part__problem'), pk=kwargs['attempt_pk'])
 
     if randomness != attempt.randomness:
         return HttpResponseNotFound("404 Not Found")
-    
-    number = models.Attempt.objects.filter(owner=request.user, part=attempt.part).count()
-    attachment_filename = "%s-%d.txt" % (attempt.part.name, number)
-    return sendfile(request, path, attachment=True, attachment_filename=attachment_filename)
+
+    path = attempt.get_inputfile_path()
+    attachment_filename = "%s-%d.txt" % (attempt.part.name, attempt.id)
+    indexed = lookup(attempt.part_id, "inputs", attempt.testfileid)
+    if indexed is None:
+        return serve_file(request, path, filename=attachment_filename, content_type="text/plain", max_age=3600)
+
+    info, compressed = indexed
+    if compressed and "gzip" in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response = serve_file(request, models.get_bundle_path(path), filename=attachment_filename,
+                content_type="text/plain", encoding="gzip", max_age=3600, stat=compressed)
+    else:
+        response = serve_file(request, path, filename=attachment_filename,
+                content_type="text/plain", max_age=3600, stat=info)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
 
 def download_pdf(request, contest=None, slug=None, attach=True, **kwargs):
     problem = get_object_or_404(models.Problem, contest__slug=contest, slug=slug)
 
     if problem.contest.has_ended() or request.user.is_authenticated() and problem.contest.has_contestant(request.user):
-        return sendfile(request, problem.pdf.path, attachment=attach, attachment_filename=slug+".pdf")
+        return serve_file(request, problem.pdf.path, attachment=attach, filename=slug+".pdf", max_age=300)
 
     return HttpResponseNotFound("404 Not Found")
 
@@ -153,8 +212,10 @@ class ProblemSubmissions(ContestantMixin, DetailView):
 
     def get_context_data(self, **kwargs):
         ctxt = super().get_context_data(**kwargs)
+        expire_attempts(self.request.user.attempts.filter(part__problem=self.object))
         myattempts = self.request.user.attempts.filter(part__problem=self.object).all()
         ctxt['attempts'] = myattempts
+        ctxt['events'] = settings.JUDGE_EVENTS
         return ctxt
 
 class ProblemClarifications(DetailView):
@@ -165,6 +226,7 @@ class ProblemClarifications(DetailView):
         ctxt = super().get_context_data(**kwargs)
         clarifications = self.object.clarifications.all()
         ctxt['clarifications'] = clarifications
+        ctxt['events'] = settings.JUDGE_EVENTS
         return ctxt
 
 class ProblemAskClarification(ContestantMixin, SuccessMessageMixin, CreateView):
@@ -194,25 +256,104 @@ class ProblemAskClarification(ContestantMixin, SuccessMessageMixin, CreateView):
             'slug': self.problem.slug,
         })
 
+def encode_cursor(attempt):
+    return "%s_%d" % (attempt.created_at.isoformat(), attempt.pk)
+
+def decode_cursor(cursor):
+    try:
+        created_at, pk = cursor.rsplit("_", 1)
+        return parse_datetime(created_at), int(pk)
+    except (AttributeError, ValueError, TypeError):
+        return None
+
+def filter_submissions(contest, params):
+    """
+    Returns the contest's attempts, newest first, narrowed down by the
+    status, problem and user filters in `params`.
+    """
+    parts = models.ProblemPart.objects.filter(problem__contest=contest)
+    if params.get('problem'):
+        parts = parts.filter(problem__slug=params['problem'])
+
+    attempts = models.Attempt.objects.filter(part__in=list(parts.values_list('id', flat=True))) \
+            .select_related('owner', 'part__problem').order_by('-created_at', '-id')
+    if params.get('status', '').isdigit():
+        attempts = attempts.filter(status=int(params['status']))
+    if params.get('user'):
+        attempts = attempts.filter(owner__username=params['user'])
+    return attempts
+
 class AdminSubmissionList(ListView):
     model = models.Attempt
     template_name = "admin_submissions.html"
     context_object_name = 'attempts'
     contest = None
-    paginate_by = 20
+    page_size = 20
 
     def dispatch(self, *args, **kwargs):
         self.contest = get_object_or_404(models.Contest, slug=kwargs['contest'])
         return super().dispatch(*args, **kwargs)
 
     def get_queryset(self):
-        return super().get_queryset().filter(part__problem__contest=self.contest)
-    
+        expire_attempts()
+        attempts = filter_submissions(self.contest, self.request.GET)
+        cursor = decode_cursor(self.request.GET.get('before'))
+        if cursor:
+            created_at, pk = cursor
+            attempts = attempts.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        return list(attempts[:self.page_size + 1])
+
     def get_context_data(self, **kwargs):
         ctxt = super().get_context_data(**kwargs)
+        attempts = ctxt['attempts']
+        ctxt['attempts'] = attempts[:self.page_size]
+
+        if len(attempts) > self.page_size:
+            params = self.request.GET.copy()
+            params['before'] = encode_cursor(attempts[self.page_size - 1])
+            ctxt['older_query'] = params.urlencode()
+        if 'before' not in self.request.GET:
+            ctxt['live'] = True
+            ctxt['cursor'] = encode_cursor(attempts[0]) if attempts else ""
+
         ctxt['contest'] = self.contest
+        ctxt['problems'] = self.contest.problems.all()
+        ctxt['statuses'] = models.Attempt.CHOICES_STATUS
+        ctxt['filters'] = self.request.GET
         return ctxt
 
+def admin_submission_feed(request, contest=None):
+    """
+    Returns, as JSON, the attempts that arrived after the `since` cursor
+    (oldest first), so the submission list can refresh itself cheaply.
+    """
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return redirect("/admin/")
+
+    contest = get_object_or_404(models.Contest, slug=contest)
+    attempts = filter_submissions(contest, request.GET)
+    cursor = decode_cursor(request.GET.get('since'))
+    if cursor:
+        created_at, pk = cursor
+        attempts = attempts.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+    attempts = list(attempts.order_by('created_at', 'id')[:100])
+
+    data = {
+        'cursor': encode_cursor(attempts[-1]) if attempts else request.GET.get('since'),
+        'attempts': [{
+            'id': attempt.id,
+            'owner': attempt.owner.username,
+            'created_at': attempt.created_at.isoformat(),
+            'problem': attempt.part.problem.name,
+            'part': attempt.part.name,
+            'status': attempt.get_status_display(),
+            'score': attempt.score,
+            'reason': attempt.get_reason_display(),
+            'url': reverse("attempt_detail", kwargs={'contest': contest.slug, 'attempt_pk': attempt.id}),
+        } for attempt in attempts],
+    }
+    return HttpResponse(json.dumps(data), content_type="application/json")
+
 class AdminAttemptDetail(DetailView):
     model = models.Attempt
     pk_url_kwarg = 'attempt_pk'
@@ -262,15 +403,14 @@ def admin_attempt_override(request, contest=None, attempt_pk=None, action=None):
         attempt.status = models.Attempt.CORRECT
         attempt.reason = models.Attempt.SCORED_MANUALLY
         attempt.score = attempt.part.points
-        attempt.save()
+        save_result(attempt)
     elif action == "wrong":
         attempt.status = models.Attempt.INCORRECT
         attempt.reason = models.Attempt.SCORED_MANUALLY
         attempt.score = 0
-        attempt.save()
+        save_result(attempt)
     elif action == "auto":
         score(attempt)
-        attempt.save()
 
     return redirect(reverse("attempt_detail", kwargs={'contest': contest, 'attempt_pk': attempt_pk}))
 
@@ -278,23 +418,47 @@ def admin_attempt_diff(request, contest=None, attempt_pk=None, quick=False):
     if not request.user.is_authenticated or not request.user.is_staff:
         return redirect("/admin/")
 
-    attempt = get_object_or_404(models.Attempt, pk=attempt_pk)
-    their_lines = []
-    my_lines = []
-
-    sizehint = [512] if quick else []
-
-    if attempt.outputfile:
-        with open(attempt.outputfile.path) as theirs:
-            their_lines = theirs.readlines(*sizehint)
-
-    with open(attempt.get_outputfile_path()) as mine:
-        my_lines = mine.readlines(*sizehint)
+    attempt = get_object_or_404(models.Attempt.objects.select_related('owner', 'part__problem__contest'), pk=attempt_pk)
 
-    differ = HtmlDiff()
-    html = differ.make_file(their_lines, my_lines, fromdesc="User's output", todesc="Judge's output")
+    # ?at=N shows the lines from N on, ?from=N jumps to the first mismatch
+    # at or after N; by default the diff opens at the first mismatch.
+    param = 'at' if 'at' in request.GET else 'from'
+    try:
+        start = max(0, int(request.GET.get(param, 0)))
+    except ValueError:
+        start = 0
+
+    result = attempt_diff(attempt, start=start, seek=(param == 'from'), quick=quick)
+
+    return render(request, "admin_submission_diff.html", {
+        'attempt': attempt,
+        'contest': attempt.part.problem.contest,
+        'diff': result,
+        'start': start,
+    })
+
+def admin_profile(request):
+    """
+    Staff-only dump of the instrumentation percentiles per view, or with
+    ?view=<url name> the latest cProfile captures for that view.
+    """
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return redirect("/admin/")
 
-    return HttpResponse(html, content_type="text/html")
+    try:
+        max_age = int(request.GET.get('max_age', 3600))
+    except ValueError:
+        return HttpResponseBadRequest("max_age must be a number of seconds.\n", content_type="text/plain")
+
+    if settings.JUDGE_INSTRUMENT:
+        instrument.flush()
+    samples, profiles = instrument.load(max_age=max_age)
+    name = request.GET.get('view')
+    if name:
+        text = "\n\n".join("%s (%.3fs)\n%s" % (entry['path'], entry['latency'], entry['stats'])
+                for entry in profiles.get(name, []))
+        return HttpResponse(text or "No profiles captured for %s.\n" % name, content_type="text/plain")
+    return HttpResponse(json.dumps(instrument.summarize(samples), indent=2), content_type="application/json")
 
 class AdminClarificationList(ListView):
     model = models.Clarification
@@ -332,19 +496,97 @@ class AdminClarificationRespond(UpdateView):
         ctxt['contest'] = self.contest
         return ctxt
 
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        if self.object.answer:
+            events.publish(events.clarification_event(self.object))
+        return response
+
     def get_success_url(self):
         return reverse("clarification_list", kwargs={
             'contest': self.contest.slug,
         })
 
-def scoreboard(request, contest=None):
+def contest_events(request, contest=None):
+    """
+    Server-Sent Events stream of the viewer's verdicts and the contest's
+    scoreboard and clarification updates. Each open stream occupies its
+    worker, so this URL should be served by async (gevent) workers, and
+    it doesn't exist unless settings.JUDGE_EVENTS is on.
+    """
+    if not settings.JUDGE_EVENTS:
+        return HttpResponseNotFound("404 Not Found")
     obj = get_object_or_404(models.Contest, slug=contest)
+    user_id = request.user.pk if request.user.is_authenticated() else None
+    last_id = request.META.get('HTTP_LAST_EVENT_ID', '')
+    response = StreamingHttpResponse(events.stream(obj.id, user_id, int(last_id) if last_id.isdigit() else None),
+            content_type="text/event-stream")
+    response['Cache-Control'] = "no-cache"
+    response['X-Accel-Buffering'] = "no"
+    return response
 
+def scoreboard(request, contest=None):
+    obj = get_object_or_404(models.Contest, slug=contest)
+    shownames = obj.has_ended() or request.user.is_staff
+    frozen = obj.is_frozen() and not request.user.is_staff
+    version = get_version(obj.id, "frozen" if frozen else "version")
+    etag = get_etag(obj.id, version, shownames, request.user)
+
+    # No Last-Modified: HTTP dates have whole seconds, so a board that
+    # changed twice within a second would be answered with a stale 304.
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        response = HttpResponseNotModified()
+    else:
+        response = render(request, "scoreboard.html", {
+            'table': render_table(obj, version, shownames, frozen),
+            'contest': obj,
+            'shownames': shownames,
+            'frozen': frozen,
+            'events': settings.JUDGE_EVENTS,
+        })
 
-    teams = obj.contestants.all()
-    for team in teams:
-        team.score = obj.get_score(team)
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, max_age=0, must_revalidate=True)
+    return response
 
-    teams = sorted(teams, key=lambda t: -t.score)
+def scoreboard_history(request, contest=None):
+    """
+    Replays the scoreboard as it stood `at` minutes into the contest, from
+    the history log. Open to everyone once the final results are public;
+    staff can also export the raw log with ?format=csv.
+    """
+    obj = get_object_or_404(models.Contest, slug=contest)
+    if not request.user.is_staff and (not obj.has_ended() or obj.is_frozen()):
+        return redirect(reverse("scoreboard", kwargs={'contest': obj.slug}))
+
+    if request.GET.get('format') == "csv" and request.user.is_staff:
+        out = io.StringIO()
+        history.write_csv(obj.id, out)
+        response = HttpResponse(out.getvalue(), content_type="text/csv")
+        response['Content-Disposition'] = 'attachment; filename="%s-history.csv"' % obj.slug
+        return response
 
-    return render(request, "scoreboard.html", {'teams': teams, 'contest': obj, 'shownames': obj.has_ended() or request.user.is_staff})
+    duration = int((obj.end_at - obj.begin_at).total_seconds() // 60)
+    minutes = duration
+    if 'at' in request.GET:
+        try:
+            minutes = float(request.GET['at'])
+        except ValueError:
+            minutes = None
+        if minutes is None or not math.isfinite(minutes):
+            return HttpResponseBadRequest("at must be a number of minutes.\n", content_type="text/plain")
+        minutes = min(max(minutes, 0), duration)
+    problems, teams = history.build_scoreboard(obj, obj.begin_at.timestamp() + minutes * 60)
+
+    if request.GET.get('format') == "json":
+        data = [{'rank': team.rank, 'team': team.team.username, 'score': team.score,
+                'penalty': team.penalty, 'problems': [score for problem, score in team.problems]}
+                for team in teams]
+        return HttpResponse(json.dumps({'at': minutes, 'standings': data}), content_type="application/json")
+
+    return render(request, "scoreboard_history.html", {
+        'contest': obj,
+        'minutes': int(minutes),
+        'duration': duration,
+        'table': render_to_string("scoreboard_table.html", {'problems': problems, 'teams': teams, 'shownames': True}),
+    })